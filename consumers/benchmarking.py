@@ -0,0 +1,28 @@
+"""Shared timing helpers for the producer and consumer benchmarks"""
+import logging
+import statistics
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def time_case(name, func, ops, repeat):
+    """Runs `func` `repeat` times and summarizes its timings. `ops` is the number
+    of operations a single call performs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    result = {
+        "name": name,
+        "ops": ops,
+        "repeat": repeat,
+        "best_s": best,
+        "median_s": statistics.median(timings),
+        "ops_per_s": ops / best if best > 0 else None,
+    }
+    logger.info(f"{name}: {result['ops_per_s']:,.0f} ops/s (best of {repeat})")
+    return result
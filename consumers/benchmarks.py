@@ -0,0 +1,206 @@
+"""Benchmarks the consumer message handling and page rendering hot paths
+
+Usage: python benchmarks.py [--stations N] [--messages N] [--batch-size N]
+                     [--output FILE]
+
+Results are written as JSON so runs can be compared across commits.
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+from types import SimpleNamespace
+
+from benchmarking import time_case
+from config import CtaTopics, join_topic_name
+from models import Lines, Weather
+from server import MainHandler
+
+
+logger = logging.getLogger(__name__)
+
+LINE_COLORS = ("blue", "green", "red")
+
+
+class FakeMessage:
+    """Stands in for a consumed Kafka message"""
+
+    def __init__(self, topic, value):
+        self._topic = topic
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def value(self):
+        return self._value
+
+
+def station_messages(num_stations):
+    """Faust-transformed station records, spread evenly across the lines"""
+    return [
+        FakeMessage(
+            CtaTopics.STATIONS_LINE,
+            json.dumps(
+                {
+                    "station_id": 100000 + i,
+                    "station_name": f"Station {i:05d}",
+                    "order": i,
+                    "line": LINE_COLORS[i % len(LINE_COLORS)],
+                }
+            ),
+        )
+        for i in range(num_stations)
+    ]
+
+
+def arrival_messages(rng, num_stations, num_messages):
+    messages = []
+    for _ in range(num_messages):
+        station = rng.randrange(num_stations)
+        messages.append(
+            FakeMessage(
+                join_topic_name(CtaTopics.ARRIVALS_PREFIX, f"station_{station:05d}"),
+                {
+                    "station_id": 100000 + station,
+                    "train_id": f"BL{rng.randrange(1000):03d}",
+                    "direction": rng.choice("ab"),
+                    "line": LINE_COLORS[station % len(LINE_COLORS)],
+                    "train_status": "in_service",
+                    "prev_station_id": 100000 + max(station - 1, 0),
+                    "prev_direction": rng.choice("ab"),
+                },
+            )
+        )
+    return messages
+
+
+def turnstile_summary_messages(rng, num_stations, num_messages):
+    return [
+        FakeMessage(
+            CtaTopics.TURNSTILES_SUMMARY,
+            json.dumps(
+                {
+                    "STATION_ID": 100000 + rng.randrange(num_stations),
+                    "COUNT": rng.randrange(100000),
+                }
+            ),
+        )
+        for _ in range(num_messages)
+    ]
+
+
+def bench_process_messages(name, lines, messages, repeat):
+    def run():
+        for message in messages:
+            lines.process_message(message)
+
+    return time_case(name, run, len(messages), repeat)
+
+
+def bench_process_batches(name, lines, messages, batch_size, repeat):
+    batches = [
+        messages[i : i + batch_size] for i in range(0, len(messages), batch_size)
+    ]
+
+    def run():
+        for batch in batches:
+            lines.process_messages(batch)
+
+    return time_case(name, run, len(messages), repeat)
+
+
+def run_benchmarks(args):
+    """Runs every benchmark and returns the report"""
+    rng = random.Random(args.seed)
+    lines = Lines()
+    stations = station_messages(args.stations)
+    arrivals = arrival_messages(rng, args.stations, args.messages)
+    summaries = turnstile_summary_messages(rng, args.stations, args.messages)
+
+    results = [
+        bench_process_messages(
+            "lines.process_message[stations]", lines, stations, args.repeat
+        ),
+        bench_process_messages(
+            "lines.process_message[arrivals]", lines, arrivals, args.repeat
+        ),
+        bench_process_messages(
+            "lines.process_message[turnstile_summary]", lines, summaries, args.repeat
+        ),
+        bench_process_batches(
+            "lines.process_messages[arrivals]",
+            lines,
+            arrivals,
+            args.batch_size,
+            args.repeat,
+        ),
+        bench_process_batches(
+            "lines.process_messages[turnstile_summary]",
+            lines,
+            summaries,
+            args.batch_size,
+            args.repeat,
+        ),
+    ]
+
+    weather = Weather()
+
+    def render():
+        for _ in range(args.renders):
+            MainHandler.template.generate(weather=weather, lines=lines)
+
+    results.append(time_case("main_handler.render", render, args.renders, args.repeat))
+
+    handler = SimpleNamespace(weather=weather, lines=lines)
+
+    def cached_render():
+        for _ in range(args.renders):
+            MainHandler.rendered_page(handler)
+
+    results.append(
+        time_case(
+            "main_handler.rendered_page[cached]",
+            cached_render,
+            args.renders,
+            args.repeat,
+        )
+    )
+    return {
+        "suite": "consumers",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "stations": args.stations,
+            "messages": args.messages,
+            "renders": args.renders,
+            "batch_size": args.batch_size,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--renders", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    # Logging is configured from logging.ini when server.py is imported
+    args = parse_args()
+    report = json.dumps(run_benchmarks(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    else:
+        print(report)
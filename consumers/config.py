@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 
 NAMESPACE = "org.chicago.cta"
 CONSUMER_GROUP = "cta_transit_optimization"
@@ -22,8 +22,119 @@ class Connections:
     }
 
 
+class TransportSettings:
+    # Where producers and consumers exchange messages: "kafka", "memory" for an
+    # in-process broker or "file" for append-only topic logs under FILE_DIR
+    BACKEND: str = "kafka"
+    FILE_DIR: str = "/tmp/cta-transport"
+
+
+class RecordingSettings:
+    # Directory the simulation records every produced event to, None disables it
+    DIRECTORY: Optional[str] = None
+    # Events per segment file, and per compressed block within a segment
+    SEGMENT_RECORDS: int = 1000000
+    BLOCK_RECORDS: int = 1000
+
+
+class ProducerSettings:
+    # Number of AvroProducer clients shared by every Producer in the process
+    POOL_SIZE: int = 1
+    LINGER_MS: int = 50
+    BATCH_NUM_MESSAGES: int = 10000
+    QUEUE_BUFFERING_MAX_MESSAGES: int = 500000
+    COMPRESSION_TYPE: str = "lz4"
+    # Queued messages allowed per pooled producer before an unthrottled
+    # simulation waits for deliveries
+    UNTHROTTLED_MAX_QUEUED: int = 100000
+    # What producing does when the local queue is full: "block" serves delivery
+    # callbacks every BACKPRESSURE_POLL_S until there is room, shedding the
+    # record after BACKPRESSURE_MAX_BLOCK_S, and "shed" drops it immediately
+    BACKPRESSURE: str = "block"
+    BACKPRESSURE_MAX_BLOCK_S: float = 5.0
+    BACKPRESSURE_POLL_S: float = 0.1
+    # Weather readings sent per REST Proxy request, and pooled HTTP connections
+    REST_PROXY_BATCH_SIZE: int = 1
+    REST_PROXY_POOL_SIZE: int = 4
+    # Seconds a REST Proxy request may take to connect or respond before its
+    # records are counted as failed
+    REST_PROXY_TIMEOUT_S: float = 10.0
+    # How often librdkafka reports client statistics, 0 disables them
+    STATS_INTERVAL_MS: int = 10000
+    # Seconds between producer telemetry summaries, and a file each summary
+    # writes the full telemetry to as JSON
+    TELEMETRY_SUMMARY_S: float = 60.0
+    TELEMETRY_FILE: Optional[str] = None
+    # Longest shutdown waits for all clients, flushed concurrently, to deliver
+    # their queued records
+    SHUTDOWN_TIMEOUT_S: float = 30.0
+
+
+class ConsumerSettings:
+    # Messages fetched per consume call and handed to a batch handler at once,
+    # 1 polls and handles them one at a time
+    BATCH_SIZE: int = 500
+    # The pause between batches halves down to this while messages keep arriving
+    # and doubles up to the consumer's `sleep_secs` while it is idle
+    MIN_SLEEP_S: float = 0.01
+    # Poll and decode on a background thread per consumer, handing the batches to
+    # the IOLoop, so that requests are not served behind Kafka I/O
+    BACKGROUND_POLLING: bool = False
+    # Batches a background consumer lets wait on the IOLoop before it pauses
+    MAX_PENDING_BATCHES: int = 4
+    # Consume every status server topic with one client, routing messages to the
+    # weather or lines models by topic, instead of with one client per topic
+    MULTIPLEXED: bool = False
+    # Apply only the last train update per station and direction, and the last
+    # turnstile count per station, of every consumed batch
+    COALESCE: bool = False
+
+
+class ServerSettings:
+    # Shortest time between two renders of the status page. While the models keep
+    # changing, requests in between are served the cached page
+    RENDER_MIN_INTERVAL_S: float = 1.0
+
+
+class SimulationSettings:
+    # Emit one turnstile record per station per tick carrying the entry count
+    # instead of one record per rider
+    AGGREGATE_TURNSTILES: bool = False
+    # Seed for the turnstile ridership random generator, None for a random seed
+    RIDERSHIP_SEED: Optional[int] = None
+    # Advance simulated time as fast as the producers can drain instead of
+    # waiting `sleep_seconds` of wall-clock time between ticks
+    UNTHROTTLED: bool = False
+    # Generate `BACKFILL_DAYS` of history as fast as possible, stamping keys and
+    # record timestamps with the simulated event time
+    BACKFILL: bool = False
+    BACKFILL_DAYS: int = 7
+    # Number of worker processes the lines are spread across, 1 runs in-process
+    NUM_SHARDS: int = 1
+    # Longest the coordinator waits for every shard to reach a tick barrier
+    SHARD_TIMEOUT_S: float = 300.0
+    # Simulate a generated network of this many lines instead of the CTA "L"
+    SYNTHETIC_LINES: int = 0
+    SYNTHETIC_STATIONS_PER_LINE: int = 100
+    SYNTHETIC_TRAINS_PER_LINE: int = 10
+    SYNTHETIC_SEED: int = 0
+
+
+class TopicSettings:
+    # Publish every arrival to the single CtaTopics.ARRIVALS topic keyed by
+    # station id, instead of to one topic per station
+    CONSOLIDATED_ARRIVALS: bool = False
+    ARRIVALS_PARTITIONS: int = 6
+    # Key turnstile and arrival records by station id instead of by timestamp,
+    # so each station's records share a partition and KSQL can aggregate the
+    # turnstiles by station without repartitioning them
+    STATION_KEYED_RECORDS: bool = False
+
+
 class CtaTopics:
     ARRIVALS_PREFIX: str = join_topic_name(NAMESPACE, "station.arrivals")
+    # The consolidated arrivals topic, see TopicSettings.CONSOLIDATED_ARRIVALS
+    ARRIVALS: str = ARRIVALS_PREFIX
     TURNSTILES: str = join_topic_name(NAMESPACE, "station.turnstiles")
     TURNSTILES_SUMMARY: str = join_topic_name(TURNSTILES, "summary")
     STATIONS: str = join_topic_name(NAMESPACE, "stations")
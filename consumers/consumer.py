@@ -1,13 +1,18 @@
 """Defines core consumer functionality"""
+from collections import namedtuple
 import logging
+import re
+import threading
 
 from confluent_kafka import OFFSET_BEGINNING
 from confluent_kafka import Consumer
-from confluent_kafka.avro import AvroConsumer
+from confluent_kafka.avro import AvroConsumer, CachedSchemaRegistryClient
 from confluent_kafka.avro.serializer import SerializerError
+from confluent_kafka.avro.serializer.message_serializer import MessageSerializer
 from tornado import gen
 
 import config
+import transport
 
 logger = logging.getLogger(__name__)
 
@@ -23,25 +28,62 @@ class KafkaConsumer:
         offset_earliest=False,
         sleep_secs=1.0,
         consume_timeout=0.1,
+        batch_handler=None,
+        batch_size=None,
+        background=None,
     ):
-        """Creates a consumer object for asynchronous use"""
+        """Creates a consumer object for asynchronous use. With a `batch_handler`
+        messages are fetched `batch_size` at a time and handed over as a list.
+        A `background` consumer is run with `start_background` instead."""
         self.topic_name_pattern = topic_name_pattern
         self.message_handler = message_handler
         self.sleep_secs = sleep_secs
         self.consume_timeout = consume_timeout
         self.offset_earliest = offset_earliest
+        self.batch_handler = batch_handler
+        self.batch_size = batch_size
+        if self.batch_size is None:
+            self.batch_size = config.ConsumerSettings.BATCH_SIZE
+        self.batched = self.batch_handler is not None and self.batch_size > 1
+        self.background = background
+        if self.background is None:
+            self.background = config.ConsumerSettings.BACKGROUND_POLLING
+        self.thread = None
+        # Decodes Avro batches, which AvroConsumer only does for polled messages
+        self.serializer = None
         self.broker_properties = {
             "bootstrap.servers": config.Connections.KAFKA_BROKER,
             "group.id": config.CONSUMER_GROUP,
         }
 
-        if is_avro is True:
+        if not transport.uses_kafka():
+            self.consumer = transport.TransportConsumer(
+                transport.broker(), self.broker_properties
+            )
+        elif is_avro is True and (self.batched or self.background) is True:
+            self.consumer = Consumer(self.broker_properties)
+            self.serializer = KafkaConsumer.new_serializer()
+        elif is_avro is True:
             self.broker_properties["schema.registry.url"] = config.Connections.SCHEMA_REGISTRY
             self.consumer = AvroConsumer(self.broker_properties)
         else:
             self.consumer = Consumer(self.broker_properties)
 
-        self.consumer.subscribe([self.topic_name_pattern], on_assign=self.on_assign)
+        self.consumer.subscribe(self.subscription(), on_assign=self.on_assign)
+
+    @staticmethod
+    def new_serializer() -> MessageSerializer:
+        return MessageSerializer(
+            CachedSchemaRegistryClient({"url": config.Connections.SCHEMA_REGISTRY})
+        )
+
+    def subscription(self):
+        """Returns the topic names and patterns the client subscribes to"""
+        return [self.topic_name_pattern]
+
+    def is_avro_topic(self, topic):
+        """Whether messages of `topic` need decoding by the serializer"""
+        return True
 
     def on_assign(self, consumer, partitions):
         """Callback for when topic assignment takes place"""
@@ -54,12 +96,67 @@ class KafkaConsumer:
 
     async def consume(self):
         """Asynchronously consumes data from kafka topic"""
+        if self.batched is True:
+            await self._consume_batches()
+            return
         while True:
             num_results = 1
             while num_results > 0:
                 num_results = self._consume()
             await gen.sleep(self.sleep_secs)
 
+    async def _consume_batches(self):
+        """Consumes batches with an adaptive pause between them: none after a
+        full batch, shrinking while batches keep arriving and growing while idle"""
+        sleep_secs = config.ConsumerSettings.MIN_SLEEP_S
+        while True:
+            num_results = self._consume_batch()
+            if num_results >= self.batch_size:
+                sleep_secs = config.ConsumerSettings.MIN_SLEEP_S
+                # Only yield to the IOLoop, more messages are likely waiting
+                await gen.sleep(0)
+                continue
+            if num_results > 0:
+                sleep_secs = max(sleep_secs / 2, config.ConsumerSettings.MIN_SLEEP_S)
+            else:
+                sleep_secs = min(sleep_secs * 2, self.sleep_secs)
+            await gen.sleep(sleep_secs)
+
+    def _consume_batch(self):
+        """Fetches up to `batch_size` messages and hands those without errors to
+        the batch handler. Returns the number of messages fetched"""
+        num_results, batch = self._fetch_batch(self.consume_timeout)
+        if batch:
+            self.batch_handler(batch)
+        return num_results
+
+    def _fetch_batch(self, timeout):
+        """Fetches up to `batch_size` messages, waiting at most `timeout` for the
+        first. Returns the number fetched and those without errors, decoded"""
+        messages = self.consumer.consume(self.batch_size, timeout)
+        batch = []
+        for msg in messages:
+            if msg.error():
+                logger.error(
+                    f"{self.topic_name_pattern} | Consumer error: {msg.error()}"
+                )
+                continue
+            if self.serializer is not None and self.is_avro_topic(msg.topic()):
+                try:
+                    self._decode(msg)
+                except SerializerError as exc:
+                    logger.error(f"{self.topic_name_pattern} | {exc}")
+                    continue
+            batch.append(msg)
+        return len(messages), batch
+
+    def _decode(self, msg):
+        """Replaces the Avro encoded key and value of a message with their data"""
+        if msg.value() is not None:
+            msg.set_value(self.serializer.decode_message(msg.value(), is_key=False))
+        if msg.key() is not None:
+            msg.set_key(self.serializer.decode_message(msg.key(), is_key=True))
+
     def _consume(self):
         """Polls for a message. Returns 1 if a message was received, 0 otherwise"""
         try:
@@ -78,6 +175,128 @@ class KafkaConsumer:
             self.message_handler(msg)
             return 1
 
+    def start_background(self, io_loop):
+        """Polls and decodes on a daemon thread, which hands every batch to the
+        handlers on `io_loop`. Once `MAX_PENDING_BATCHES` are waiting there the
+        thread stops fetching until the IOLoop catches up."""
+        self.io_loop = io_loop
+        self.pending = threading.BoundedSemaphore(
+            config.ConsumerSettings.MAX_PENDING_BATCHES
+        )
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._poll_in_background,
+            name=f"consumer {self.topic_name_pattern}",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def _poll_in_background(self):
+        """Background thread loop, blocking in consume while there is no data"""
+        while not self.stopping.is_set():
+            _, batch = self._fetch_batch(self.sleep_secs)
+            if not batch:
+                continue
+            while not self.pending.acquire(timeout=self.sleep_secs):
+                if self.stopping.is_set():
+                    return
+            self.io_loop.add_callback(self._handle_pending, batch)
+
+    def _handle_pending(self, batch):
+        """Runs on the IOLoop, handing a batch fetched in the background over"""
+        try:
+            if self.batch_handler is not None:
+                self.batch_handler(batch)
+            else:
+                for msg in batch:
+                    self.message_handler(msg)
+        finally:
+            self.pending.release()
+
     def close(self):
         """Cleans up any open kafka consumers"""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
         self.consumer.close()
+
+
+Route = namedtuple("Route", ["topic_pattern", "handler", "is_avro"])
+
+
+class MultiplexedConsumer(KafkaConsumer):
+    """Consumes the topics of several routes with a single client
+
+    Every `Route` names a topic, or a pattern starting with "^", the batch handler
+    of its messages and whether they are Avro encoded. Batches are split into
+    runs of consecutive messages sharing a handler, so that the order across
+    topics is kept. The route of a topic is resolved once and then looked up in
+    the routing table.
+    """
+
+    def __init__(self, routes, **kwargs):
+        self.routes = routes
+        self.patterns = [
+            (re.compile(route.topic_pattern), route)
+            for route in routes
+            if route.topic_pattern.startswith("^")
+        ]
+        # Topic name -> Route, None for topics no route matches
+        self.routing_table = {
+            route.topic_pattern: route
+            for route in routes
+            if not route.topic_pattern.startswith("^")
+        }
+        super().__init__(
+            ",".join(route.topic_pattern for route in routes),
+            self.dispatch_message,
+            is_avro=False,
+            batch_handler=self.dispatch,
+            **kwargs,
+        )
+        if transport.uses_kafka() and any(route.is_avro for route in routes):
+            self.serializer = KafkaConsumer.new_serializer()
+
+    def subscription(self):
+        return [route.topic_pattern for route in self.routes]
+
+    def is_avro_topic(self, topic):
+        route = self.route(topic)
+        return route is not None and route.is_avro
+
+    def route(self, topic):
+        """Returns the route of `topic`, or None if it has none"""
+        try:
+            return self.routing_table[topic]
+        except KeyError:
+            pass
+        route = next(
+            (route for pattern, route in self.patterns if pattern.match(topic)), None
+        )
+        self.routing_table[topic] = route
+        return route
+
+    async def consume(self):
+        """Asynchronously consumes data from all routed topics"""
+        await self._consume_batches()
+
+    def dispatch(self, messages):
+        """Hands each run of messages routed to the same handler over at once"""
+        handler = None
+        run = []
+        for message in messages:
+            route = self.route(message.topic())
+            if route is None:
+                logger.debug(f"no route for messages from {message.topic()}")
+                continue
+            if route.handler != handler:
+                if run:
+                    handler(run)
+                handler = route.handler
+                run = []
+            run.append(message)
+        if run:
+            handler(run)
+
+    def dispatch_message(self, message):
+        self.dispatch([message])
@@ -16,12 +16,22 @@ logger = logging.getLogger(__name__)
 #       `turnstile` table and grouping on station_id.
 #       Make sure to cast the COUNT of station id to `count`
 #       Make sure to set the value format to JSON
+# Turnstile events carry a `num_entries` count (always 1 unless the simulation
+# runs with aggregated turnstiles), so the summary sums it instead of counting
+# rows. Records written before the field existed count as a single entry.
+#
+# With `TopicSettings.STATION_KEYED_RECORDS` the turnstile records are keyed by
+# station id, so `KEY='station_id'` holds and the GROUP BY reads them from the
+# partitions they were produced to instead of repartitioning. As a table only the
+# latest record of each station would survive, so they are read as a stream.
+TURNSTILE_SOURCE = "STREAM" if config.TopicSettings.STATION_KEYED_RECORDS else "TABLE"
 
 KSQL_STATEMENT = f"""
-CREATE TABLE turnstile (
+CREATE {TURNSTILE_SOURCE} turnstile (
     station_id INT,
     station_name STRING,
-    line STRING
+    line STRING,
+    num_entries INT
 ) WITH (
     KAFKA_TOPIC='{config.CtaTopics.TURNSTILES}',
     VALUE_FORMAT='AVRO',
@@ -35,7 +45,7 @@ CREATE TABLE turnstile_summary
     ) AS
     SELECT
         station_id,
-        COUNT(*) AS count
+        SUM(IFNULL(num_entries, 1)) AS count
     FROM turnstile
     GROUP BY station_id;
 """
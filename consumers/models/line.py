@@ -24,14 +24,15 @@ class Line:
         self.stations = {}
 
     def _handle_station(self, value):
-        """Adds the station to this Line's data model"""
+        """Adds the station to this Line's data model and returns it"""
         if value["line"] != self.color:
-            return
-        self.stations[value["station_id"]] = Station.from_message(value)
+            return None
+        station = Station.from_message(value)
+        self.stations[value["station_id"]] = station
+        return station
 
-    def _handle_arrival(self, message):
+    def _handle_arrival(self, value):
         """Updates train locations"""
-        value = message.value()
         prev_station_id = value.get("prev_station_id")
         prev_dir = value.get("prev_direction")
         if prev_dir is not None and prev_station_id is not None:
@@ -64,9 +65,10 @@ class Line:
                 self._handle_station(value)
             except Exception as e:
                 logger.fatal("bad station? %s, %s", value, e)
-        # Set the conditional to the arrival topics
+        # Set the conditional to the arrival topics. The per-station topics and
+        # the consolidated arrivals topic all start with the prefix
         elif topic.startswith(CtaTopics.ARRIVALS_PREFIX):
-            self._handle_arrival(message)
+            self._handle_arrival(message.value())
         # Set the conditional to the KSQL Turnstile Summary Topic
         elif topic == CtaTopics.TURNSTILES_SUMMARY:
             json_data = json.loads(message.value())
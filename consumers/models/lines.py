@@ -1,8 +1,9 @@
 """Contains functionality related to Lines"""
+from collections import Counter
 import json
 import logging
 
-from config import CtaTopics
+from config import ConsumerSettings, CtaTopics
 from models import Line
 
 
@@ -10,36 +11,137 @@ logger = logging.getLogger(__name__)
 
 
 class Lines:
-    """Contains all train lines"""
+    """Contains all train lines
+
+    Messages are decoded once here and routed straight to their line, or, for
+    turnstile summaries, to their station through the station index.
+    """
 
     def __init__(self):
         """Creates the Lines object"""
         self.red_line = Line("red")
         self.green_line = Line("green")
         self.blue_line = Line("blue")
+        self.lines = {
+            line.color: line
+            for line in (self.red_line, self.green_line, self.blue_line)
+        }
+        # Station id -> [(Line, Station)] of every line the station is on
+        self.stations = {}
+        # Bumped whenever a message may have changed the lines
+        self.version = 0
+        # Train and turnstile updates consumed in batches, and how many of them
+        # were applied to the stations after coalescing
+        self.updates_received = Counter()
+        self.updates_applied = Counter()
 
     def process_message(self, message):
         """Processes a station message"""
+        self.version += 1
         topic: str = message.topic()
-        if topic.startswith(CtaTopics.ARRIVALS_PREFIX) or topic in [
-            CtaTopics.TURNSTILES,
-            CtaTopics.STATIONS,
-            CtaTopics.STATIONS_LINE,
-        ]:
+        if topic == CtaTopics.STATIONS_LINE:
+            value = json.loads(message.value())
+            line = self._line(value)
+            if line is not None:
+                try:
+                    self._add_station(line, value)
+                except Exception as e:
+                    logger.fatal("bad station? %s, %s", value, e)
+        elif topic.startswith(CtaTopics.ARRIVALS_PREFIX):
             value = message.value()
-            if topic == CtaTopics.STATIONS_LINE:
-                value = json.loads(value)
-            if value["line"] == "green":
-                self.green_line.process_message(message)
-            elif value["line"] == "red":
-                self.red_line.process_message(message)
-            elif value["line"] == "blue":
-                self.blue_line.process_message(message)
-            else:
-                logger.debug("discarding unknown line msg %s", value["line"])
+            line = self._line(value)
+            if line is not None:
+                line._handle_arrival(value)
         elif topic == CtaTopics.TURNSTILES_SUMMARY:
-            self.green_line.process_message(message)
-            self.red_line.process_message(message)
-            self.blue_line.process_message(message)
+            self._handle_summary(json.loads(message.value()))
+        elif topic in (CtaTopics.TURNSTILES, CtaTopics.STATIONS):
+            logger.debug("unable to find handler for message from topic %s", topic)
         else:
             logger.info("ignoring non-lines message %s", message.topic())
+
+    def _line(self, value):
+        """Returns the line a message belongs to, None for unknown lines"""
+        line = self.lines.get(value["line"])
+        if line is None:
+            logger.debug("discarding unknown line msg %s", value["line"])
+        return line
+
+    def _add_station(self, line, value):
+        """Adds a station to its line and the index, replacing an earlier
+        announcement of it on the same line"""
+        entries = [
+            entry
+            for entry in self.stations.get(value["station_id"], [])
+            if entry[0] is not line
+        ]
+        entries.append((line, line._handle_station(value)))
+        self.stations[value["station_id"]] = entries
+
+    def _handle_summary(self, json_data):
+        """Updates the turnstile count of a station on every line it is on"""
+        entries = self.stations.get(json_data.get("STATION_ID"))
+        if not entries:
+            logger.debug("unable to handle message due to missing station")
+            return
+        for _, station in entries:
+            station.process_message(json_data)
+
+    def process_messages(self, messages):
+        """Processes a batch of messages in order. With `COALESCE` enabled, only
+        the last train update per station and direction, and the last turnstile
+        count per station, is applied. Pending updates are applied before any
+        other message, so that e.g. a station announced mid-batch still starts
+        out empty."""
+        if ConsumerSettings.COALESCE is not True:
+            for message in messages:
+                self.process_message(message)
+            return
+        self.version += 1
+
+        # (Line, station id, direction) -> (train id, status), None on departure
+        trains = {}
+        # Station id -> latest turnstile summary
+        counts = {}
+        for message in messages:
+            topic: str = message.topic()
+            if topic.startswith(CtaTopics.ARRIVALS_PREFIX):
+                value = message.value()
+                line = self._line(value)
+                if line is None:
+                    continue
+                prev_station_id = value.get("prev_station_id")
+                prev_dir = value.get("prev_direction")
+                if prev_dir is not None and prev_station_id is not None:
+                    trains[(line, prev_station_id, prev_dir)] = None
+                    self.updates_received["trains"] += 1
+                trains[(line, value.get("station_id"), value.get("direction"))] = (
+                    value.get("train_id"),
+                    value.get("train_status"),
+                )
+                self.updates_received["trains"] += 1
+            elif topic == CtaTopics.TURNSTILES_SUMMARY:
+                json_data = json.loads(message.value())
+                counts[json_data.get("STATION_ID")] = json_data
+                self.updates_received["turnstiles"] += 1
+            else:
+                self._apply_updates(trains, counts)
+                self.process_message(message)
+        self._apply_updates(trains, counts)
+
+    def _apply_updates(self, trains, counts):
+        """Applies and clears coalesced train and turnstile updates"""
+        for (line, station_id, direction), train in trains.items():
+            station = line.stations.get(station_id)
+            if station is None:
+                logger.debug("unable to handle update due to missing station")
+                continue
+            if train is None:
+                station.handle_departure(direction)
+            else:
+                station.handle_arrival(direction, *train)
+        for json_data in counts.values():
+            self._handle_summary(json_data)
+        self.updates_applied["trains"] += len(trains)
+        self.updates_applied["turnstiles"] += len(counts)
+        trains.clear()
+        counts.clear()
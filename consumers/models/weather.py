@@ -12,10 +12,17 @@ class Weather:
         """Creates the weather model"""
         self.temperature = 70.0
         self.status = "sunny"
+        # Bumped whenever the weather is updated
+        self.version = 0
 
     def process_message(self, message):
         """Handles incoming weather data"""
         value = message.value()
+        self.version += 1
         self.temperature = value["temperature"]
         self.status = value["status"]
         logger.debug(f"Weather: {self.temperature} | {self.status}")
+
+    def process_messages(self, messages):
+        """Handles a batch of weather data, of which only the latest is kept"""
+        self.process_message(messages[-1])
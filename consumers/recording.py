@@ -0,0 +1,201 @@
+"""Records produced events to segment files and reads them back for replay
+
+A segment starts with `MAGIC` and holds zlib-compressed blocks, each framed by
+its compressed length and entry count. Inside a block every entry is a line of
+compact JSON: `["t", topic_id, topic, key_schema, value_schema]` declares a
+topic the first time a segment uses it, and `[topic_id, event_ms, key, value]`
+is a record. Segments roll over after `RecordingSettings.SEGMENT_RECORDS`.
+"""
+import argparse
+from collections import namedtuple
+import heapq
+import json
+import logging
+import os
+from pathlib import Path
+import struct
+import time
+import zlib
+
+from config import RecordingSettings
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CTASEG1\n"
+BLOCK_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".ctaseg"
+
+Record = namedtuple(
+    "Record", ["topic", "event_ms", "key", "value", "key_schema", "value_schema"]
+)
+
+
+class SegmentRecorder:
+    """Appends events to rolling segment files in a directory
+
+    File names carry the process id, so every process of a sharded simulation
+    writes its own segments into the same directory.
+    """
+
+    def __init__(self, directory, segment_records=None, block_records=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_records = segment_records
+        if self.segment_records is None:
+            self.segment_records = RecordingSettings.SEGMENT_RECORDS
+        self.block_records = block_records
+        if self.block_records is None:
+            self.block_records = RecordingSettings.BLOCK_RECORDS
+        self.segment_index = 0
+        self.segment = None
+        self.segment_count = 0
+        self.topic_ids = {}
+        self.block = []
+        self.num_records = 0
+
+    def record(self, topic, event_ms, key, value, key_schema=None, value_schema=None):
+        """Adds an event, opening a new segment when the current one is full"""
+        if self.segment is None or self.segment_count >= self.segment_records:
+            self._roll_segment()
+        topic_id = self.topic_ids.get(topic)
+        if topic_id is None:
+            topic_id = self.topic_ids[topic] = len(self.topic_ids)
+            self.block.append(
+                json.dumps(
+                    [
+                        "t",
+                        topic_id,
+                        topic,
+                        _schema_json(key_schema),
+                        _schema_json(value_schema),
+                    ],
+                    separators=(",", ":"),
+                )
+            )
+        self.block.append(
+            json.dumps([topic_id, event_ms, key, value], separators=(",", ":"))
+        )
+        self.segment_count += 1
+        self.num_records += 1
+        if len(self.block) >= self.block_records:
+            self.flush()
+
+    def flush(self):
+        """Compresses and writes the pending block"""
+        if not self.block:
+            return
+        data = zlib.compress("\n".join(self.block).encode("utf-8"))
+        self.segment.write(BLOCK_HEADER.pack(len(data), len(self.block)))
+        self.segment.write(data)
+        self.block = []
+
+    def _roll_segment(self):
+        self.close()
+        while self.segment is None:
+            path = self.directory / (
+                f"segment-{os.getpid()}-{self.segment_index:05d}{SEGMENT_SUFFIX}"
+            )
+            self.segment_index += 1
+            try:
+                self.segment = open(path, "xb")
+            except FileExistsError:
+                # Left by an earlier recording of this process
+                continue
+        logger.info(f"Recording events to {path}")
+        self.segment.write(MAGIC)
+        self.segment_count = 0
+        # Topics are declared again in every segment so each can be read alone
+        self.topic_ids = {}
+
+    def close(self):
+        """Writes the pending block and closes the current segment"""
+        if self.segment is None:
+            return
+        self.flush()
+        self.segment.close()
+        self.segment = None
+
+
+def _schema_json(schema):
+    return None if schema is None else json.dumps(schema.to_json())
+
+
+def read_segment(path):
+    """Yields the records of one segment file in the order they were recorded"""
+    with open(path, "rb") as segment:
+        if segment.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a recorded segment")
+        topics = {}
+        while True:
+            header = segment.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            size, _ = BLOCK_HEADER.unpack(header)
+            data = segment.read(size)
+            if len(data) < size:
+                logger.warning(f"{path} ends in a truncated block, stopping")
+                return
+            for line in zlib.decompress(data).split(b"\n"):
+                entry = json.loads(line)
+                if entry[0] == "t":
+                    topics[entry[1]] = entry[2:]
+                    continue
+                topic, key_schema, value_schema = topics[entry[0]]
+                yield Record(
+                    topic, entry[1], entry[2], entry[3], key_schema, value_schema
+                )
+
+
+def segment_paths(paths):
+    """Expands directories into the segment files they contain"""
+    expanded = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            expanded.extend(sorted(path.glob(f"*{SEGMENT_SUFFIX}")))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def read_segments(paths):
+    """Yields the records of several segments merged by event time"""
+    segments = [read_segment(path) for path in segment_paths(paths)]
+    return heapq.merge(*segments, key=lambda record: record.event_ms)
+
+
+def paced(records, speed=1.0):
+    """Yields records spaced by their event time divided by `speed`. A speed of
+    None or 0 yields them as fast as they can be consumed."""
+    if not speed:
+        yield from records
+        return
+    start = None
+    for record in records:
+        if start is None:
+            start = (record.event_ms, time.monotonic())
+        due = start[1] + (record.event_ms - start[0]) / 1000.0 / speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield record
+
+
+def parse_speed(speed):
+    """Parses a replay speed multiplier, "max" meaning no pacing"""
+    if speed == "max":
+        return None
+    return float(speed)
+
+
+def parse_replay_args(description, argv=None):
+    """Parses the command line shared by the producer and consumer replays"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("paths", nargs="+", help="segment files or directories")
+    parser.add_argument(
+        "--speed",
+        type=parse_speed,
+        default=1.0,
+        help='multiple of the recorded rate, or "max" (default: 1)',
+    )
+    return parser.parse_args(argv)
@@ -1,15 +1,26 @@
 """Defines a Tornado Server that consumes Kafka Event data for display"""
+from collections import namedtuple
+import gzip
+import hashlib
 import logging
 import logging.config
 from pathlib import Path
+import time
 
 import tornado.ioloop
 import tornado.template
 import tornado.web
 
-from config import CtaTopics
-from consumer import KafkaConsumer
+from config import (
+    CtaTopics,
+    ConsumerSettings,
+    ServerSettings,
+    TopicSettings,
+    TransportSettings,
+)
+from consumer import KafkaConsumer, MultiplexedConsumer, Route
 import topic_check
+import transport
 
 # Import logging before models to ensure configuration is picked up
 logging.config.fileConfig(Path(__file__).parents[0] / "logging.ini")
@@ -19,34 +30,78 @@ from models import Lines, Weather  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
+RenderedPage = namedtuple(
+    "RenderedPage",
+    ["version", "rendered_at", "etag", "body", "gzipped", "gzipped_etag"],
+)
+
 
 class MainHandler(tornado.web.RequestHandler):
-    """Defines a web request handler class"""
+    """Defines a web request handler class
+
+    The page is rendered again only once the models changed, and at most every
+    `ServerSettings.RENDER_MIN_INTERVAL_S`. All requests share the rendered
+    body, its gzipped copy and an ETag for each of them, so unchanged pages are
+    answered with 304 Not Modified.
+    """
 
     template_dir = tornado.template.Loader(Path(__file__).parents[0] / "templates")
     template = template_dir.load("status.html")
+    # The latest RenderedPage
+    page = None
 
     def initialize(self, weather, lines):
         """Initializes the handler with required configuration"""
         self.weather = weather
         self.lines = lines
 
+    def rendered_page(self) -> RenderedPage:
+        """Returns the cached page, rendering it again if it is out of date"""
+        version = (self.weather.version, self.lines.version)
+        page = MainHandler.page
+        now = time.monotonic()
+        if page is not None and (
+            page.version == version
+            or now - page.rendered_at < ServerSettings.RENDER_MIN_INTERVAL_S
+        ):
+            return page
+        logging.debug("rendering handler template")
+        body = MainHandler.template.generate(weather=self.weather, lines=self.lines)
+        digest = hashlib.sha1(body).hexdigest()
+        MainHandler.page = RenderedPage(
+            version, now, f'"{digest}"', body, gzip.compress(body), f'"{digest}-gzip"'
+        )
+        return MainHandler.page
+
     def get(self):
         """Responds to get requests"""
-        logging.debug("rendering and writing handler template")
-        self.write(
-            MainHandler.template.generate(weather=self.weather, lines=self.lines)
-        )
+        page = self.rendered_page()
+        # Strong validators have to differ between the two encodings of the page
+        gzipped = "gzip" in self.request.headers.get("Accept-Encoding", "")
+        self.set_header("Etag", page.gzipped_etag if gzipped else page.etag)
+        self.set_header("Vary", "Accept-Encoding")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        if gzipped:
+            self.set_header("Content-Encoding", "gzip")
+            self.write(page.gzipped)
+        else:
+            self.write(page.body)
 
 
 def run_server():
     """Runs the Tornado Server and begins Kafka consumption"""
-    if topic_check.topic_exists(CtaTopics.TURNSTILES_SUMMARY) is False:
+    if not transport.uses_kafka():
+        # KSQL and Faust only run against Kafka, the simulation publishes the
+        # station and turnstile summary records in their place
+        logger.info(f"Using the {TransportSettings.BACKEND} transport")
+    elif topic_check.topic_exists(CtaTopics.TURNSTILES_SUMMARY) is False:
         logger.fatal(
             "Ensure that the KSQL Command has run successfully before running the web server!"
         )
         exit(1)
-    if topic_check.topic_exists(CtaTopics.STATIONS_LINE) is False:
+    elif topic_check.topic_exists(CtaTopics.STATIONS_LINE) is False:
         logger.fatal(
             "Ensure that Faust Streaming is running successfully before running the web server!"
         )
@@ -61,35 +116,60 @@ def run_server():
     application.listen(8888)
 
     # Build kafka consumers
-    consumers = [
-        KafkaConsumer(
-            CtaTopics.WEATHER, weather_model.process_message, offset_earliest=True,
-        ),
-        KafkaConsumer(
-            CtaTopics.STATIONS_LINE,
-            lines.process_message,
-            offset_earliest=True,
-            is_avro=False,
-        ),
-        KafkaConsumer(
-            f"^{CtaTopics.ARRIVALS_PREFIX}.*",
-            lines.process_message,
-            offset_earliest=True,
-        ),
-        KafkaConsumer(
-            CtaTopics.TURNSTILES_SUMMARY,
-            lines.process_message,
-            offset_earliest=True,
-            is_avro=False,
-        ),
-    ]
+    arrivals_topic = f"^{CtaTopics.ARRIVALS_PREFIX}.*"
+    if TopicSettings.CONSOLIDATED_ARRIVALS:
+        arrivals_topic = CtaTopics.ARRIVALS
+    if ConsumerSettings.MULTIPLEXED is True:
+        consumers = [
+            MultiplexedConsumer(
+                [
+                    Route(CtaTopics.WEATHER, weather_model.process_messages, True),
+                    Route(CtaTopics.STATIONS_LINE, lines.process_messages, False),
+                    Route(arrivals_topic, lines.process_messages, True),
+                    Route(CtaTopics.TURNSTILES_SUMMARY, lines.process_messages, False),
+                ],
+                offset_earliest=True,
+            )
+        ]
+    else:
+        consumers = [
+            KafkaConsumer(
+                CtaTopics.WEATHER,
+                weather_model.process_message,
+                offset_earliest=True,
+                batch_handler=weather_model.process_messages,
+            ),
+            KafkaConsumer(
+                CtaTopics.STATIONS_LINE,
+                lines.process_message,
+                offset_earliest=True,
+                is_avro=False,
+                batch_handler=lines.process_messages,
+            ),
+            KafkaConsumer(
+                arrivals_topic,
+                lines.process_message,
+                offset_earliest=True,
+                batch_handler=lines.process_messages,
+            ),
+            KafkaConsumer(
+                CtaTopics.TURNSTILES_SUMMARY,
+                lines.process_message,
+                offset_earliest=True,
+                is_avro=False,
+                batch_handler=lines.process_messages,
+            ),
+        ]
 
     try:
         logger.info(
             "Open a web browser to http://localhost:8888 to see the Transit Status Page"
         )
         for consumer in consumers:
-            tornado.ioloop.IOLoop.current().spawn_callback(consumer.consume)
+            if consumer.background is True:
+                consumer.start_background(tornado.ioloop.IOLoop.current())
+            else:
+                tornado.ioloop.IOLoop.current().spawn_callback(consumer.consume)
 
         tornado.ioloop.IOLoop.current().start()
     except KeyboardInterrupt:
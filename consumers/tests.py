@@ -0,0 +1,499 @@
+import asyncio
+import gzip
+import json
+import time
+
+from confluent_kafka.avro.serializer import SerializerError
+import pytest
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+from config import ConsumerSettings, CtaTopics, ServerSettings, TransportSettings
+import consumer
+from consumer import KafkaConsumer, MultiplexedConsumer, Route
+from models import Lines, Weather
+import server
+import transport
+from transport import Message
+
+ARRIVALS = f"{CtaTopics.ARRIVALS_PREFIX}.station"
+
+
+def station_message(station_id, line, order=0):
+    value = json.dumps(
+        {
+            "station_id": station_id,
+            "station_name": f"Station {station_id}",
+            "order": order,
+            "line": line,
+        }
+    )
+    return Message(CtaTopics.STATIONS_LINE, 0, 0, None, value, 0)
+
+
+def arrival_message(
+    station_id, direction, train_id, line="blue", prev_station_id=None, prev_dir=None
+):
+    value = {
+        "station_id": station_id,
+        "train_id": train_id,
+        "direction": direction,
+        "line": line,
+        "train_status": "in_service",
+        "prev_station_id": prev_station_id,
+        "prev_direction": prev_dir,
+    }
+    return Message(ARRIVALS, 0, 0, None, value, 0)
+
+
+def summary_message(station_id, count):
+    value = json.dumps({"STATION_ID": station_id, "COUNT": count})
+    return Message(CtaTopics.TURNSTILES_SUMMARY, 0, 0, None, value, 0)
+
+
+class FakeMessage:
+    """A consumed message with an optional error, decodable in place"""
+
+    def __init__(self, topic, value, error=None):
+        self._topic = topic
+        self._value = value
+        self._error = error
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return None
+
+    def value(self):
+        return self._value
+
+    def set_value(self, value):
+        self._value = value
+
+    def error(self):
+        return self._error
+
+
+class FakeSerializer:
+    """Decodes values by prefixing them, failing on the value "bad" """
+
+    def __init__(self):
+        self.decoded = []
+
+    def decode_message(self, value, is_key=False):
+        if value == "bad":
+            raise SerializerError("not avro")
+        self.decoded.append(value)
+        return f"decoded {value}"
+
+
+class StubConsumer:
+    """Returns the same messages from every consume call"""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def consume(self, num_messages=1, timeout=-1):
+        return self.messages
+
+
+@pytest.fixture
+def memory_broker(monkeypatch):
+    monkeypatch.setattr(TransportSettings, "BACKEND", "memory")
+    monkeypatch.setattr(transport, "brokers", {})
+    return transport.broker()
+
+
+def produce(broker, topic, values):
+    producer = transport.TransportProducer(broker, {})
+    for value in values:
+        producer.produce(topic=topic, key=None, value=value)
+
+
+def lines_state(lines):
+    return {
+        color: {
+            station_id: (s.dir_a, s.dir_b, s.num_turnstile_entries)
+            for station_id, s in line.stations.items()
+        }
+        for color, line in lines.lines.items()
+    }
+
+
+def test_coalesced_batch_matches_processing_one_message_at_a_time(monkeypatch):
+    stations = [
+        station_message(1, "blue", 0),
+        station_message(2, "blue", 1),
+        station_message(3, "blue", 2),
+        station_message(4, "green", 0),
+    ]
+    batch = [
+        arrival_message(1, "a", "BL1"),
+        arrival_message(2, "a", "BL1", prev_station_id=1, prev_dir="a"),
+        arrival_message(1, "a", "BL2"),
+        summary_message(1, 5),
+        summary_message(1, 7),
+        # Re-announcing a station resets it, pending updates go first
+        station_message(2, "blue", 1),
+        arrival_message(3, "b", "BL3", prev_station_id=2, prev_dir="a"),
+        # Station 1 is not on the green line
+        arrival_message(1, "a", "GL1", line="green"),
+        summary_message(4, 3),
+    ]
+
+    expected = Lines()
+    for message in stations + batch:
+        expected.process_message(message)
+
+    monkeypatch.setattr(ConsumerSettings, "COALESCE", True)
+    coalesced = Lines()
+    coalesced.process_messages(stations)
+    coalesced.process_messages(batch)
+
+    assert lines_state(coalesced) == lines_state(expected)
+    assert coalesced.lines["blue"].stations[1].dir_a["train_id"] == "BL2"
+    assert coalesced.lines["blue"].stations[2].dir_a is None
+    assert coalesced.updates_received == {"trains": 7, "turnstiles": 3}
+    assert coalesced.updates_applied == {"trains": 5, "turnstiles": 2}
+
+
+class CountingMessage(FakeMessage):
+    """Counts how often its value is read"""
+
+    def __init__(self, message):
+        super().__init__(message.topic(), message.value())
+        self.reads = 0
+
+    def value(self):
+        self.reads += 1
+        return super().value()
+
+
+def test_station_on_two_lines_is_kept_on_both():
+    lines = Lines()
+    for message in (
+        station_message(40380, "blue"),
+        station_message(40380, "green"),
+        # Re-announcing on the same line replaces only that line's entry
+        station_message(40380, "blue", order=1),
+    ):
+        lines.process_message(message)
+
+    assert 40380 in lines.blue_line.stations
+    assert 40380 in lines.green_line.stations
+    assert [line.color for line, _ in lines.stations[40380]] == ["green", "blue"]
+    assert lines.stations[40380][1][1] is lines.blue_line.stations[40380]
+
+
+def test_turnstile_summary_reaches_every_line_with_the_station():
+    lines = Lines()
+    for message in (
+        station_message(40380, "blue"),
+        station_message(40380, "green"),
+        station_message(41400, "red"),
+        summary_message(40380, 12),
+    ):
+        lines.process_message(message)
+
+    assert lines.blue_line.stations[40380].num_turnstile_entries == 12
+    assert lines.green_line.stations[40380].num_turnstile_entries == 12
+    assert lines.red_line.stations[41400].num_turnstile_entries == 0
+
+
+def test_arrival_only_reaches_the_line_it_names():
+    lines = Lines()
+    for message in (
+        station_message(40380, "blue"),
+        station_message(40380, "green"),
+        arrival_message(40380, "a", "BL1"),
+    ):
+        lines.process_message(message)
+
+    assert lines.blue_line.stations[40380].dir_a["train_id"] == "BL1"
+    assert lines.green_line.stations[40380].dir_a is None
+
+
+def test_lines_decode_each_message_once():
+    messages = [
+        CountingMessage(message)
+        for message in (
+            station_message(40380, "blue"),
+            station_message(40380, "green"),
+            arrival_message(40380, "a", "BL1"),
+            summary_message(40380, 3),
+        )
+    ]
+    lines = Lines()
+    for message in messages:
+        lines.process_message(message)
+
+    assert [message.reads for message in messages] == [1, 1, 1, 1]
+    assert lines.green_line.stations[40380].num_turnstile_entries == 3
+
+
+def test_consume_batch_hands_over_valid_decoded_messages(memory_broker):
+    batches = []
+    kafka_consumer = KafkaConsumer(
+        "weather", print, batch_handler=batches.append, batch_size=10
+    )
+    messages = [
+        FakeMessage("weather", "sunny"),
+        FakeMessage("weather", "windy", error="broker down"),
+        FakeMessage("weather", "bad"),
+        FakeMessage("weather", "cloudy"),
+    ]
+    kafka_consumer.consumer = StubConsumer(messages)
+    kafka_consumer.serializer = FakeSerializer()
+
+    assert kafka_consumer._consume_batch() == 4
+    assert [[m.value() for m in batch] for batch in batches] == [
+        ["decoded sunny", "decoded cloudy"]
+    ]
+
+
+class StopConsuming(Exception):
+    pass
+
+
+def test_consume_batches_adapts_the_sleep_to_the_load(memory_broker, monkeypatch):
+    monkeypatch.setattr(ConsumerSettings, "MIN_SLEEP_S", 0.01)
+    kafka_consumer = KafkaConsumer(
+        "weather", print, sleep_secs=0.05, batch_handler=print, batch_size=10
+    )
+    results = iter([0, 0, 0, 0, 3, 3, 10, 0])
+
+    def consume_batch():
+        try:
+            return next(results)
+        except StopIteration:
+            raise StopConsuming()
+
+    sleeps = []
+
+    async def sleep(duration):
+        sleeps.append(duration)
+
+    monkeypatch.setattr(kafka_consumer, "_consume_batch", consume_batch)
+    monkeypatch.setattr(consumer.gen, "sleep", sleep)
+    with pytest.raises(StopConsuming):
+        asyncio.run(kafka_consumer.consume())
+    assert sleeps == pytest.approx([0.02, 0.04, 0.05, 0.05, 0.025, 0.0125, 0, 0.02])
+
+
+def test_consume_batches_reads_from_the_transport(memory_broker):
+    memory_broker.create_topic("weather")
+    produce(memory_broker, "weather", [{"seq": i} for i in range(5)])
+    batches = []
+    kafka_consumer = KafkaConsumer(
+        "weather",
+        print,
+        offset_earliest=True,
+        batch_handler=batches.append,
+        batch_size=3,
+    )
+    while kafka_consumer._consume_batch():
+        pass
+    assert [[m.value()["seq"] for m in batch] for batch in batches] == [
+        [0, 1, 2],
+        [3, 4],
+    ]
+
+
+class QueueingLoop:
+    """Stands in for the IOLoop, queueing callbacks until they are run"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    def run_next(self):
+        callback, args = self.callbacks.pop(0)
+        callback(*args)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_background_consumer_limits_pending_batches(memory_broker, monkeypatch):
+    monkeypatch.setattr(ConsumerSettings, "MAX_PENDING_BATCHES", 2)
+    memory_broker.create_topic("weather")
+    produce(memory_broker, "weather", [{"seq": i} for i in range(4)])
+    batches = []
+    kafka_consumer = KafkaConsumer(
+        "weather",
+        print,
+        offset_earliest=True,
+        sleep_secs=0.05,
+        batch_handler=batches.append,
+        batch_size=1,
+        background=True,
+    )
+    loop = QueueingLoop()
+    kafka_consumer.start_background(loop)
+
+    assert wait_for(lambda: len(loop.callbacks) == 2)
+    time.sleep(0.2)
+    assert len(loop.callbacks) == 2
+    loop.run_next()
+    assert wait_for(lambda: len(loop.callbacks) == 2)
+    while loop.callbacks:
+        loop.run_next()
+    assert wait_for(lambda: len(loop.callbacks) == 1)
+    loop.run_next()
+    assert [batch[0].value()["seq"] for batch in batches] == [0, 1, 2, 3]
+
+    kafka_consumer.close()
+    assert not kafka_consumer.thread.is_alive()
+
+
+class Recorder:
+    """Batch handler recording the batches it receives in a shared log"""
+
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    def handle(self, messages):
+        self.log.append((self.name, [m.value() for m in messages]))
+
+
+def multiplexed_consumer(log):
+    weather, lines = Recorder("weather", log), Recorder("lines", log)
+    return MultiplexedConsumer(
+        [
+            Route(CtaTopics.WEATHER, weather.handle, True),
+            Route(CtaTopics.STATIONS_LINE, lines.handle, False),
+            Route(f"^{CtaTopics.ARRIVALS_PREFIX}.*", lines.handle, True),
+        ],
+        batch_size=10,
+    )
+
+
+def test_multiplexed_consumer_resolves_routes_once(memory_broker):
+    mux = multiplexed_consumer([])
+    route = mux.route(ARRIVALS)
+    assert route.topic_pattern == f"^{CtaTopics.ARRIVALS_PREFIX}.*"
+    assert mux.routing_table[ARRIVALS] is route
+    assert mux.route(CtaTopics.STATIONS_LINE).is_avro is False
+    assert mux.route("unrouted") is None
+    assert "unrouted" in mux.routing_table
+
+
+def test_multiplexed_consumer_only_decodes_avro_routes(memory_broker):
+    log = []
+    mux = multiplexed_consumer(log)
+    mux.serializer = FakeSerializer()
+    mux.consumer = StubConsumer(
+        [
+            FakeMessage(CtaTopics.STATIONS_LINE, "station"),
+            FakeMessage(ARRIVALS, "arrival"),
+            FakeMessage(CtaTopics.WEATHER, "weather"),
+        ]
+    )
+    mux._consume_batch()
+    assert mux.serializer.decoded == ["arrival", "weather"]
+    assert log == [
+        ("lines", ["station", "decoded arrival"]),
+        ("weather", ["decoded weather"]),
+    ]
+
+
+def test_multiplexed_consumer_dispatches_runs_in_order(memory_broker):
+    log = []
+    mux = multiplexed_consumer(log)
+    mux.dispatch(
+        [
+            FakeMessage(CtaTopics.STATIONS_LINE, 1),
+            FakeMessage(ARRIVALS, 2),
+            FakeMessage(CtaTopics.WEATHER, 3),
+            FakeMessage("unrouted", 4),
+            FakeMessage(ARRIVALS, 5),
+        ]
+    )
+    assert log == [("lines", [1, 2]), ("weather", [3]), ("lines", [5])]
+
+
+def serve_status_page(weather, lines):
+    """Serves the status page on an unused port and returns a fetch coroutine"""
+    application = tornado.web.Application(
+        [(r"/", server.MainHandler, {"weather": weather, "lines": lines})]
+    )
+    sock, port = tornado.testing.bind_unused_port()
+    tornado.httpserver.HTTPServer(application).add_sockets([sock])
+    client = tornado.httpclient.AsyncHTTPClient()
+
+    def fetch(**headers):
+        return client.fetch(
+            f"http://127.0.0.1:{port}/",
+            headers={name.replace("_", "-"): value for name, value in headers.items()},
+            decompress_response=False,
+            raise_error=False,
+        )
+
+    return fetch
+
+
+@pytest.fixture
+def uncached_page(monkeypatch):
+    monkeypatch.setattr(server.MainHandler, "page", None)
+    monkeypatch.setattr(ServerSettings, "RENDER_MIN_INTERVAL_S", 0)
+
+
+def test_status_page_is_not_modified_until_the_models_change(uncached_page):
+    weather = Weather()
+
+    async def run():
+        fetch = serve_status_page(weather, Lines())
+        first = await fetch()
+        unchanged = await fetch(If_None_Match=first.headers["Etag"])
+        weather.process_message(
+            Message(
+                CtaTopics.WEATHER, 0, 0, None, {"temperature": 1, "status": "windy"}, 0
+            )
+        )
+        changed = await fetch(If_None_Match=first.headers["Etag"])
+        return first, unchanged, changed
+
+    first, unchanged, changed = tornado.ioloop.IOLoop.current().run_sync(run)
+    assert first.code == 200
+    assert unchanged.code == 304
+    assert changed.code == 200
+    assert changed.headers["Etag"] != first.headers["Etag"]
+    assert b"Windy" in changed.body
+
+
+def test_status_page_etag_differs_per_encoding(uncached_page):
+    async def run():
+        fetch = serve_status_page(Weather(), Lines())
+        identity = await fetch(Accept_Encoding="identity")
+        gzipped = await fetch(Accept_Encoding="gzip")
+        mismatched = await fetch(
+            Accept_Encoding="gzip", If_None_Match=identity.headers["Etag"]
+        )
+        return identity, gzipped, mismatched
+
+    identity, gzipped, mismatched = tornado.ioloop.IOLoop.current().run_sync(run)
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.body) == identity.body
+    assert gzipped.headers["Etag"] != identity.headers["Etag"]
+    assert mismatched.code == 200
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_process_messages_bumps_the_version(monkeypatch, coalesce):
+    monkeypatch.setattr(ConsumerSettings, "COALESCE", coalesce)
+    lines = Lines()
+    lines.process_messages([station_message(1, "blue")])
+    version = lines.version
+    lines.process_messages([summary_message(1, 2)])
+    assert lines.version > version
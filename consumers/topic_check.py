@@ -1,10 +1,14 @@
 from confluent_kafka.admin import AdminClient
 
 import config
+import transport
 
 
 def topic_exists(topic):
     """Checks if the given topic exists in Kafka"""
-    client = AdminClient({"bootstrap.servers": config.Connections.KAFKA_BROKER})
+    if transport.uses_kafka():
+        client = AdminClient({"bootstrap.servers": config.Connections.KAFKA_BROKER})
+    else:
+        client = transport.TransportAdminClient(transport.broker())
     topic_metadata = client.list_topics(timeout=5)
     return topic in set(t.topic for t in iter(topic_metadata.topics.values()))
@@ -0,0 +1,537 @@
+"""Kafka stand-ins that let producers and consumers run without a cluster
+
+`TransportSettings.BACKEND` selects where messages go. "kafka" uses the real
+confluent_kafka clients. "memory" keeps topics in process memory, so producers
+and consumers must share a process. "file" appends every topic partition to a
+JSON-lines log under `TransportSettings.FILE_DIR`, which any process on the host
+can read. Records are stored as produced, so consumers receive the same dicts
+the producers sent instead of Avro bytes.
+"""
+from concurrent.futures import Future
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from types import SimpleNamespace
+import zlib
+
+from confluent_kafka import (
+    KafkaError,
+    KafkaException,
+    OFFSET_BEGINNING,
+    OFFSET_END,
+    OFFSET_INVALID,
+    TIMESTAMP_CREATE_TIME,
+    TopicPartition,
+)
+
+from config import TransportSettings
+
+
+logger = logging.getLogger(__name__)
+
+# Brokers created in this process, by backend name
+brokers = {}
+
+
+def uses_kafka():
+    """Returns True when the configured backend is a real Kafka cluster"""
+    return TransportSettings.BACKEND == "kafka"
+
+
+def broker():
+    """Returns this process's broker for the configured backend"""
+    backend = TransportSettings.BACKEND
+    if backend not in brokers:
+        if backend == "memory":
+            brokers[backend] = MemoryBroker()
+        elif backend == "file":
+            brokers[backend] = FileBroker(TransportSettings.FILE_DIR)
+        else:
+            raise ValueError(f"No transport broker for backend {backend!r}")
+        logger.info(f"Using the {backend} transport backend")
+    return brokers[backend]
+
+
+class Message:
+    """A stored record, readable through the confluent_kafka Message accessors"""
+
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_timestamp")
+
+    def __init__(self, topic, partition, offset, key, value, timestamp):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._timestamp = timestamp
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        return TIMESTAMP_CREATE_TIME, self._timestamp
+
+    def error(self):
+        return None
+
+    def latency(self):
+        # Writes complete synchronously, there is no delivery latency to report
+        return None
+
+
+class Broker:
+    """Stores topic partitions and the committed offsets of consumer groups"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.round_robin = 0
+
+    def partition_for(self, topic, key):
+        """Picks a partition by key hash, or round-robin for records without a key"""
+        num_partitions = self.num_partitions(topic)
+        if key is None:
+            self.round_robin += 1
+            return self.round_robin % num_partitions
+        key_bytes = json.dumps(key, sort_keys=True).encode("utf-8")
+        return zlib.crc32(key_bytes) % num_partitions
+
+    def wait(self, timeout):
+        """Blocks until a record may have been appended or `timeout` seconds pass"""
+        time.sleep(timeout)
+
+
+class MemoryBroker(Broker):
+    """Keeps every partition as a list of Messages in this process"""
+
+    def __init__(self):
+        super().__init__()
+        self.topics = {}
+        self.offsets = {}
+        self.version = 0
+
+    def create_topic(self, topic, num_partitions=1):
+        """Creates a topic, returning False if it already exists"""
+        with self.condition:
+            if topic in self.topics:
+                return False
+            self.topics[topic] = [[] for _ in range(num_partitions)]
+            self.version += 1
+            return True
+
+    def topic_names(self):
+        return list(self.topics)
+
+    def num_partitions(self, topic):
+        return len(self.topics[topic])
+
+    def metadata_version(self):
+        """Changes whenever a topic is created"""
+        return self.version
+
+    def append(self, topic, key, value, timestamp, partition=None):
+        """Appends a record, creating its topic like `auto.create.topics.enable`"""
+        with self.condition:
+            if topic not in self.topics:
+                self.create_topic(topic)
+            if partition is None:
+                partition = self.partition_for(topic, key)
+            log = self.topics[topic][partition]
+            message = Message(topic, partition, len(log), key, value, timestamp)
+            log.append(message)
+            self.condition.notify_all()
+        return message
+
+    def reader(self, topic, partition, offset):
+        return MemoryReader(self.topics[topic][partition], offset)
+
+    def wait(self, timeout):
+        with self.condition:
+            self.condition.wait(timeout)
+
+    def commit(self, group, offsets):
+        self.offsets.setdefault(group, {}).update(offsets)
+
+    def committed(self, group, topic, partition):
+        return self.offsets.get(group, {}).get((topic, partition))
+
+
+class MemoryReader:
+    """Reads one in-memory partition from an offset onwards"""
+
+    def __init__(self, log, offset):
+        self.log = log
+        self.offset = offset
+        if offset == OFFSET_BEGINNING:
+            self.offset = 0
+        elif offset == OFFSET_END:
+            self.offset = len(log)
+
+    def read(self, max_messages):
+        messages = self.log[self.offset : self.offset + max_messages]
+        self.offset += len(messages)
+        return messages
+
+    def close(self):
+        pass
+
+
+class FileBroker(Broker):
+    """Appends every partition to `<directory>/<topic>/<partition>.log`
+
+    Each line holds one JSON encoded `[key, value, timestamp]` record and its
+    offset is the line number. Every record is written with a single O_APPEND
+    write, so several producer processes can share a log.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.offsets_dir = self.directory / ".offsets"
+        self.offsets_dir.mkdir(exist_ok=True)
+        # Grows by one byte per created topic, see `metadata_version`
+        self.topics_log = self.directory / ".topics"
+        self.partition_counts = {}
+        self.writers = {}
+
+    def create_topic(self, topic, num_partitions=1):
+        """Creates a topic, returning False if it already exists"""
+        if (self.directory / topic).exists():
+            return False
+        # Build the partitions aside and rename them into place, so readers never
+        # see a topic without its partitions
+        staging = self.directory / f".{topic}.{os.getpid()}"
+        staging.mkdir(exist_ok=True)
+        for partition in range(num_partitions):
+            (staging / f"{partition}.log").touch()
+        try:
+            os.rename(staging, self.directory / topic)
+        except OSError:
+            for log in staging.iterdir():
+                log.unlink()
+            staging.rmdir()
+            return False
+        fd = os.open(self.topics_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b"\n")
+        finally:
+            os.close(fd)
+        return True
+
+    def topic_names(self):
+        return [
+            path.name
+            for path in self.directory.iterdir()
+            if path.is_dir() and not path.name.startswith(".")
+        ]
+
+    def num_partitions(self, topic):
+        if topic not in self.partition_counts:
+            self.partition_counts[topic] = len(
+                list((self.directory / topic).glob("*.log"))
+            )
+        return self.partition_counts[topic]
+
+    def metadata_version(self):
+        """Changes whenever a topic is created, by any process. Unlike the
+        directory's mtime, the size of the topics log changes with every topic
+        however quickly they are created."""
+        try:
+            return os.stat(self.topics_log).st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, topic, key, value, timestamp, partition=None):
+        """Appends a record, creating its topic like `auto.create.topics.enable`"""
+        if not (self.directory / topic).exists():
+            self.create_topic(topic)
+        if partition is None:
+            partition = self.partition_for(topic, key)
+        writer = self.writers.get((topic, partition))
+        if writer is None:
+            writer = os.open(
+                self.directory / topic / f"{partition}.log",
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            )
+            self.writers[(topic, partition)] = writer
+        record = json.dumps([key, value, timestamp]) + "\n"
+        os.write(writer, record.encode("utf-8"))
+        # Learning the offset would mean counting the log lines, so it is
+        # reported as unknown
+        return Message(topic, partition, OFFSET_INVALID, key, value, timestamp)
+
+    def reader(self, topic, partition, offset):
+        return FileReader(self.directory / topic / f"{partition}.log", offset)
+
+    def commit(self, group, offsets):
+        offsets_file = self.offsets_dir / f"{group}.json"
+        committed = self._load_offsets(group)
+        committed.update(
+            {
+                f"{topic}:{partition}": offset
+                for (topic, partition), offset in offsets.items()
+            }
+        )
+        tmp_file = offsets_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(committed))
+        os.replace(tmp_file, offsets_file)
+
+    def committed(self, group, topic, partition):
+        return self._load_offsets(group).get(f"{topic}:{partition}")
+
+    def _load_offsets(self, group):
+        try:
+            return json.loads((self.offsets_dir / f"{group}.json").read_text())
+        except (OSError, ValueError):
+            return {}
+
+
+class FileReader:
+    """Reads one partition log from an offset onwards"""
+
+    def __init__(self, path, offset):
+        self.topic = path.parent.name
+        self.partition = int(path.stem)
+        self.file = open(path, "rb")
+        self.offset = 0
+        if offset == OFFSET_END:
+            self._skip(float("inf"))
+        elif offset != OFFSET_BEGINNING:
+            self._skip(offset)
+
+    def _skip(self, num_lines):
+        while self.offset < num_lines and self._readline() is not None:
+            self.offset += 1
+
+    def _readline(self):
+        """Returns the next complete line, leaving a partially written one"""
+        line = self.file.readline()
+        if not line:
+            return None
+        if not line.endswith(b"\n"):
+            self.file.seek(-len(line), os.SEEK_CUR)
+            return None
+        return line
+
+    def read(self, max_messages):
+        messages = []
+        while len(messages) < max_messages:
+            line = self._readline()
+            if line is None:
+                break
+            key, value, timestamp = json.loads(line)
+            messages.append(
+                Message(self.topic, self.partition, self.offset, key, value, timestamp)
+            )
+            self.offset += 1
+        return messages
+
+    def close(self):
+        self.file.close()
+
+
+class TransportProducer:
+    """Stands in for an AvroProducer, writing records to a broker
+
+    Writes complete immediately and their delivery callbacks are served by the
+    next `poll` or `flush`, as with librdkafka. Schemas are accepted and ignored.
+    """
+
+    def __init__(self, broker, config):
+        self.broker = broker
+        self.on_delivery = config.get("on_delivery")
+        self.delivered = []
+
+    def produce(
+        self,
+        topic,
+        value=None,
+        key=None,
+        partition=None,
+        timestamp=0,
+        on_delivery=None,
+        **kwargs,
+    ):
+        if not timestamp:
+            timestamp = int(round(time.time() * 1000))
+        message = self.broker.append(topic, key, value, timestamp, partition)
+        callback = on_delivery or self.on_delivery
+        if callback is not None:
+            self.delivered.append((callback, message))
+
+    def poll(self, timeout=None):
+        delivered, self.delivered = self.delivered, []
+        for callback, message in delivered:
+            callback(None, message)
+        return len(delivered)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def __len__(self):
+        return len(self.delivered)
+
+
+class TransportAdminClient:
+    """Stands in for an AdminClient, managing the topics of a broker"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def list_topics(self, topic=None, timeout=-1):
+        topics = {
+            name: SimpleNamespace(
+                topic=name,
+                partitions={
+                    partition: SimpleNamespace(id=partition)
+                    for partition in range(self.broker.num_partitions(name))
+                },
+            )
+            for name in self.broker.topic_names()
+        }
+        return SimpleNamespace(topics=topics)
+
+    def create_topics(self, new_topics, **kwargs):
+        futures = {}
+        for new_topic in new_topics:
+            future = Future()
+            if self.broker.create_topic(new_topic.topic, new_topic.num_partitions):
+                future.set_result(None)
+            else:
+                future.set_exception(
+                    KafkaException(KafkaError(KafkaError.TOPIC_ALREADY_EXISTS))
+                )
+            futures[new_topic.topic] = future
+        return futures
+
+
+class TransportConsumer:
+    """Stands in for a Consumer or AvroConsumer reading from a broker
+
+    Subscriptions starting with "^" are regular expressions, matched against
+    topics created after subscribing as well. Partitions start at the group's
+    committed offset, otherwise according to `auto.offset.reset`.
+    """
+
+    # Longest single wait for new records, so new topics are noticed promptly
+    max_wait_s = 0.1
+
+    def __init__(self, broker, config):
+        self.broker = broker
+        self.group = config.get("group.id")
+        self.offset_reset = config.get("auto.offset.reset", "latest")
+        self.patterns = []
+        self.on_assign = None
+        self.metadata_version = None
+        self.seen_topics = set()
+        self.readers = {}
+        self.next_reader = 0
+
+    def subscribe(self, topics, on_assign=None):
+        self.patterns = [
+            re.compile(topic if topic.startswith("^") else re.escape(topic) + r"\Z")
+            for topic in topics
+        ]
+        self.on_assign = on_assign
+        self.metadata_version = None
+
+    def assign(self, partitions):
+        for partition in partitions:
+            offset = partition.offset
+            if offset == OFFSET_INVALID:
+                offset = self._start_offset(partition.topic, partition.partition)
+            self.readers[(partition.topic, partition.partition)] = self.broker.reader(
+                partition.topic, partition.partition, offset
+            )
+
+    def _start_offset(self, topic, partition):
+        committed = self.broker.committed(self.group, topic, partition)
+        if committed is not None:
+            return committed
+        if self.offset_reset in ("earliest", "smallest", "beginning"):
+            return OFFSET_BEGINNING
+        return OFFSET_END
+
+    def _refresh_assignment(self):
+        """Assigns the partitions of newly created topics matching the subscription"""
+        version = self.broker.metadata_version()
+        if version == self.metadata_version:
+            return
+        self.metadata_version = version
+        partitions = []
+        for topic in self.broker.topic_names():
+            if topic in self.seen_topics:
+                continue
+            if not any(pattern.match(topic) for pattern in self.patterns):
+                continue
+            self.seen_topics.add(topic)
+            partitions.extend(
+                TopicPartition(topic, partition, OFFSET_INVALID)
+                for partition in range(self.broker.num_partitions(topic))
+            )
+        if not partitions:
+            return
+        if self.on_assign is not None:
+            self.on_assign(self, partitions)
+        else:
+            self.assign(partitions)
+
+    def _read(self, num_messages):
+        """Reads up to `num_messages`, rotating the partition read first"""
+        readers = list(self.readers.values())
+        messages = []
+        for i in range(len(readers)):
+            reader = readers[(self.next_reader + i) % len(readers)]
+            messages.extend(reader.read(num_messages - len(messages)))
+            if len(messages) >= num_messages:
+                break
+        self.next_reader += 1
+        return messages
+
+    def consume(self, num_messages=1, timeout=-1):
+        """Returns up to `num_messages`, waiting at most `timeout` seconds for the
+        first one. A negative or None timeout waits indefinitely."""
+        if timeout is None or timeout < 0:
+            deadline = float("inf")
+        else:
+            deadline = time.monotonic() + timeout
+        while True:
+            self._refresh_assignment()
+            messages = self._read(num_messages)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return messages
+            self.broker.wait(min(remaining, TransportConsumer.max_wait_s))
+
+    def poll(self, timeout=None):
+        messages = self.consume(1, timeout)
+        return messages[0] if messages else None
+
+    def commit(self, *args, **kwargs):
+        self.broker.commit(
+            self.group,
+            {partition: reader.offset for partition, reader in self.readers.items()},
+        )
+
+    def close(self):
+        self.commit()
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
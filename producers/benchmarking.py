@@ -0,0 +1 @@
+../consumers/benchmarking.py
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""Benchmarks the simulation hot paths against a stub Kafka producer
+
+Usage: python benchmarks.py [--stations N] [--trains N] [--ticks N] [--output FILE]
+
+Results are written as JSON so runs can be compared across commits.
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import random
+import sys
+from types import SimpleNamespace
+
+from benchmarking import time_case
+from models import Line, Station, Train, Turnstile
+from models.network import generate_network
+from models.producer import Producer
+from models.ridership import RidershipEngine
+from models.topology import load_topology
+from models.turnstile_hardware import TurnstileHardware
+
+
+logger = logging.getLogger(__name__)
+
+START_TIME = datetime.datetime(2019, 1, 7, 8)
+TIME_STEP = datetime.timedelta(minutes=5)
+
+
+class StubProducer:
+    """Counts produced messages in place of a Kafka client"""
+
+    def __init__(self):
+        self.num_messages = 0
+
+    def poll(self, timeout=None):
+        return 0
+
+    def produce(self, **kwargs):
+        self.num_messages += 1
+
+    def flush(self, timeout=None):
+        return 0
+
+    def __len__(self):
+        return 0
+
+
+def use_stub_producer():
+    """Routes every Producer to a single StubProducer and skips topic creation"""
+    stub = StubProducer()
+    Producer.pool = [stub]
+    Producer.pool_index = 0
+    Producer.create_topic = lambda self: None
+    return stub
+
+
+def bench_advance_trains(args):
+    network = generate_network(1, args.stations, args.trains, seed=args.seed)
+    line = Line(network.lines[0], network.line_stations(network.lines[0]), args.trains)
+
+    def run():
+        for _ in range(args.ticks):
+            line._advance_trains()
+
+    return time_case("line.advance_trains", run, args.trains * args.ticks, args.repeat)
+
+
+def bench_turnstile_hardware(args):
+    station_ids = list(load_topology()["ridership"])
+    hardware = [
+        TurnstileHardware(SimpleNamespace(station_id=station_ids[i % len(station_ids)]))
+        for i in range(args.stations)
+    ]
+
+    def run():
+        for tick in range(args.ticks):
+            timestamp = START_TIME + tick * TIME_STEP
+            for turnstile in hardware:
+                turnstile.get_entries(timestamp, TIME_STEP)
+
+    return time_case(
+        "turnstile_hardware.get_entries",
+        run,
+        args.stations * args.ticks,
+        args.repeat,
+    )
+
+
+def bench_ridership_engine(args):
+    network = generate_network(1, args.stations, args.trains, seed=args.seed)
+    engine = RidershipEngine(
+        list(network.ridership),
+        seed=args.seed,
+        ridership=network.ridership,
+        hour_ratios=network.hour_ratios,
+    )
+
+    def run():
+        for tick in range(args.ticks):
+            engine.get_entries(START_TIME + tick * TIME_STEP, TIME_STEP)
+
+    return time_case(
+        "ridership_engine.get_entries",
+        run,
+        args.stations * args.ticks,
+        args.repeat,
+    )
+
+
+def bench_advance_turnstiles(args, aggregate):
+    network = generate_network(1, args.stations, args.trains, seed=args.seed)
+    line = Line(network.lines[0], network.line_stations(network.lines[0]), args.trains)
+    for station in line.stations:
+        station.turnstile.aggregate = aggregate
+    engine = RidershipEngine(
+        [station.station_id for station in line.stations],
+        seed=args.seed,
+        ridership=network.ridership,
+        hour_ratios=network.hour_ratios,
+    )
+    entries = [
+        engine.get_entries(START_TIME + tick * TIME_STEP, TIME_STEP).tolist()
+        for tick in range(args.ticks)
+    ]
+    stub = Producer.pool[0]
+
+    def run():
+        for tick in range(args.ticks):
+            line._advance_turnstiles(
+                START_TIME + tick * TIME_STEP, TIME_STEP, entries[tick]
+            )
+
+    stub.num_messages = 0
+    result = time_case(
+        f"line.advance_turnstiles[aggregate={aggregate}]",
+        run,
+        args.stations * args.ticks,
+        args.repeat,
+    )
+    result["messages"] = stub.num_messages // args.repeat
+    return result
+
+
+def bench_station_run(args):
+    stations = [
+        Station(100000 + i, f"Station {i:05d}", Line.colors.blue)
+        for i in range(args.stations)
+    ]
+    train = Train("BL000", Train.status.in_service)
+
+    def run():
+        for _ in range(args.ticks):
+            for station in stations:
+                station.run(train, "a", 100000, "b")
+
+    return time_case("station.run", run, args.stations * args.ticks, args.repeat)
+
+
+def bench_turnstile_run(args):
+    station = SimpleNamespace(
+        station_id=40380, name="Clark/Lake", color=Line.colors.blue
+    )
+    turnstile = Turnstile(station, aggregate=False)
+
+    def run():
+        for _ in range(args.ticks * args.stations):
+            turnstile.run(START_TIME, TIME_STEP, 1)
+
+    return time_case("turnstile.run", run, args.stations * args.ticks, args.repeat)
+
+
+def run_benchmarks(args):
+    """Runs every benchmark and returns the report"""
+    random.seed(args.seed)
+    use_stub_producer()
+    results = [
+        bench_advance_trains(args),
+        bench_turnstile_hardware(args),
+        bench_ridership_engine(args),
+        bench_advance_turnstiles(args, aggregate=False),
+        bench_advance_turnstiles(args, aggregate=True),
+        bench_station_run(args),
+        bench_turnstile_run(args),
+    ]
+    return {
+        "suite": "producers",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "stations": args.stations,
+            "trains": args.trains,
+            "ticks": args.ticks,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=100)
+    parser.add_argument("--trains", type=int, default=10)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    args = parse_args()
+    report = json.dumps(run_benchmarks(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    else:
+        print(report)
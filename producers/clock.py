@@ -0,0 +1,54 @@
+"""Paces the simulation loop in wall-clock time"""
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationClock:
+    """Schedules simulation ticks at a fixed wall-clock rate
+
+    Ticks are scheduled relative to the start of the run instead of the end of
+    the previous tick, so the time spent doing work does not accumulate as
+    drift. In unthrottled mode ticks are never delayed.
+    """
+
+    def __init__(self, tick_seconds, unthrottled=False):
+        self.tick_seconds = tick_seconds
+        self.unthrottled = unthrottled
+        self.next_tick = None
+        self.ticks = 0
+        self.overruns = 0
+
+    def start(self):
+        """Anchors the tick schedule to the current time"""
+        self.next_tick = time.monotonic()
+        self.ticks = 0
+        self.overruns = 0
+
+    def wait(self):
+        """Blocks until the next tick is due"""
+        self.ticks += 1
+        if self.unthrottled is True:
+            return
+        if self.next_tick is None:
+            self.start()
+
+        self.next_tick += self.tick_seconds
+        delay = self.next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return
+
+        self.overruns += 1
+        logger.warning(
+            f"simulation tick {self.ticks} overran its {self.tick_seconds}s budget "
+            f"by {-delay:.3f}s"
+        )
+        # Re-anchor instead of bursting through the missed ticks
+        self.next_tick = time.monotonic()
+
+    def summary(self):
+        """Returns a one line description of the ticks run so far"""
+        return f"{self.ticks} ticks, {self.overruns} overran"
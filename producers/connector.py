@@ -6,6 +6,7 @@ import requests
 
 from config import Connections, CtaTopics
 from models.producer import Producer
+import transport
 
 
 logger = logging.getLogger(__name__)
@@ -15,12 +16,20 @@ TOPIC_PREFIX, TABLE_NAME = CtaTopics.STATIONS.rsplit(".", maxsplit=1)
 CONNECTOR_NAME = f"jdbc_source_postgres_{TABLE_NAME}"
 
 
+def create_topic():
+    """Creates the topic the connector writes station rows to"""
+    Producer(topic_name=CtaTopics.STATIONS, num_partitions=1)
+
+
 def configure_connector():
     """Starts and configures the Kafka Connect connector"""
     logging.debug("creating or updating kafka connect connector...")
 
     # create required topic for sending data to Kafka
-    Producer(topic_name=CtaTopics.STATIONS, num_partitions=1)
+    create_topic()
+    if not transport.uses_kafka():
+        logger.info("no Kafka Connect without a Kafka cluster, skipping connector")
+        return
 
     resp = requests.get(f"{KAFKA_CONNECT_URL}/{CONNECTOR_NAME}")
     if resp.status_code == 200:
@@ -2,6 +2,8 @@
 from enum import IntEnum
 import logging
 
+import numpy as np
+
 from models import Station, Train
 
 
@@ -21,43 +23,43 @@ class Line:
         self.stations = self._build_line_data(station_data)
         # We must always discount the terminal station at the end of each direction
         self.num_stations = len(self.stations) - 1
+        self._build_position_index()
         self.trains = self._build_trains()
 
-    def _build_line_data(self, station_df):
-        """Constructs all stations on the line"""
+    def _build_line_data(self, station_data):
+        """Constructs all stations on the line from its ordered
+        `(station_id, station_name)` pairs"""
         logger.info(f"Line#{self.color}: Constructing Stations on the Line")
-        stations = station_df["station_name"].unique()
-
-        station_data = station_df[station_df["station_name"] == stations[0]]
-        line = [
-            Station(station_data["station_id"].unique()[0], stations[0], self.color)
-        ]
-        prev_station = line[0]
-        for station in stations[1:]:
-            station_data = station_df[station_df["station_name"] == station]
-            new_station = Station(
-                station_data["station_id"].unique()[0],
-                station,
-                self.color,
-                prev_station,
-            )
-            prev_station.dir_b = new_station
+        line = []
+        prev_station = None
+        for station_id, station_name in station_data:
+            new_station = Station(station_id, station_name, self.color, prev_station)
+            if prev_station is not None:
+                prev_station.dir_b = new_station
             prev_station = new_station
             line.append(new_station)
         return line
 
+    def _train_prefix(self):
+        """CTA trains are named after the first letter of their line, e.g. BL001.
+        Generated lines all start with the same letter, so their full name is used"""
+        if self.color.name in Line.colors.__members__:
+            return self.color.name[0].upper()
+        return self.color.name.upper()
+
     def _build_trains(self):
         """Constructs and assigns train objects to stations"""
         logger.info(f"Line#{self.color}: Assigning Train objects to Stations")
         trains = []
+        positions = []
         curr_loc = 0
         b_dir = True
+        prefix = self._train_prefix()
         for train_id in range(self.num_trains):
             tid = str(train_id).zfill(3)
-            train = Train(
-                f"{self.color.name[0].upper()}L{tid}", Train.status.in_service
-            )
+            train = Train(f"{prefix}L{tid}", Train.status.in_service)
             trains.append(train)
+            positions.append(self._get_position(curr_loc, b_dir))
 
             if b_dir:
                 self.stations[curr_loc].arrive_b(train, None, None)
@@ -65,109 +67,76 @@ class Line:
                 self.stations[curr_loc].arrive_a(train, None, None)
             curr_loc, b_dir = self._get_next_idx(curr_loc, b_dir)
 
+        # Loop position of every train, indexed like ``trains``
+        self.train_positions = np.array(positions, dtype=np.int32)
         return trains
 
-    def run(self, timestamp, time_step):
+    def run(self, timestamp, time_step, turnstile_entries=None):
         """Advances trains between stations in the simulation. Runs turnstiles."""
-        self._advance_turnstiles(timestamp, time_step)
+        self._advance_turnstiles(timestamp, time_step, turnstile_entries)
         self._advance_trains()
 
     def close(self):
         """Called to stop the simulation"""
         _ = [station.close() for station in self.stations]
 
-    def _advance_turnstiles(self, timestamp, time_step):
-        """Advances the turnstiles in the simulation"""
-        _ = [station.turnstile.run(timestamp, time_step) for station in self.stations]
+    def _advance_turnstiles(self, timestamp, time_step, turnstile_entries=None):
+        """Advances the turnstiles in the simulation, optionally with precomputed
+        entry counts (one per station, in line order)"""
+        if turnstile_entries is None:
+            turnstile_entries = [None] * len(self.stations)
+        _ = [
+            station.turnstile.run(timestamp, time_step, num_entries)
+            for station, num_entries in zip(self.stations, turnstile_entries)
+        ]
 
     def _advance_trains(self):
-        """Advances trains between stations in the simulation"""
-        # Find the first b train
-        curr_train, curr_index, b_direction = self._next_train()
-        self.stations[curr_index].b_train = None
+        """Advances every train one position along the line in a single pass"""
+        cycle_length = len(self.position_station)
+        # Trains move in loop order starting from the first b-direction position
+        order = np.argsort(self.train_positions, kind="stable")
+        departures = self.train_positions[order]
+        arrivals = (departures + 1) % cycle_length
+        self.train_positions = (self.train_positions + 1) % cycle_length
+
+        for train_idx, prev_pos, next_pos in zip(
+            order.tolist(), departures.tolist(), arrivals.tolist()
+        ):
+            train = self.trains[train_idx]
 
-        trains_advanced = 0
-        while trains_advanced < self.num_trains - 1:
             # The train departs the current station
-            if b_direction is True:
-                self.stations[curr_index].b_train = None
+            prev_station = self.stations[self.position_station[prev_pos]]
+            if self.position_b[prev_pos]:
+                if prev_station.b_train is train:
+                    prev_station.b_train = None
+                prev_dir = "b"
             else:
-                self.stations[curr_index].a_train = None
-
-            prev_station = self.stations[curr_index].station_id
-            prev_dir = "b" if b_direction else "a"
-
-            # Advance this train to the next station
-            curr_index, b_direction = self._get_next_idx(
-                curr_index, b_direction, step_size=1
-            )
-            if b_direction is True:
-                self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
-            else:
-                self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
-
-            # Find the next train to advance
-            move = 1 if b_direction else -1
-            next_train, curr_index, b_direction = self._next_train(
-                curr_index + move, b_direction
-            )
-            if b_direction is True:
-                curr_train = self.stations[curr_index].b_train
+                if prev_station.a_train is train:
+                    prev_station.a_train = None
+                prev_dir = "a"
+
+            # And arrives at the next one
+            next_station = self.stations[self.position_station[next_pos]]
+            if self.position_b[next_pos]:
+                next_station.arrive_b(train, prev_station.station_id, prev_dir)
             else:
-                curr_train = self.stations[curr_index].a_train
-
-            curr_train = next_train
-            trains_advanced += 1
-
-        # The last train departs the current station
-        if b_direction is True:
-            self.stations[curr_index].b_train = None
-        else:
-            self.stations[curr_index].a_train = None
-
-        # Advance last train to the next station
-        prev_station = self.stations[curr_index].station_id
-        prev_dir = "b" if b_direction else "a"
-        curr_index, b_direction = self._get_next_idx(
-            curr_index, b_direction, step_size=1
-        )
-        if b_direction is True:
-            self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
-        else:
-            self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
-
-    def _next_train(self, start_index=0, b_direction=True, step_size=1):
-        """Given a starting index, finds the next train in either direction"""
-        if b_direction is True:
-            curr_index = self._next_train_b(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_a(len(self.stations) - 1, step_size)
-                b_direction = False
-        else:
-            curr_index = self._next_train_a(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_b(0, step_size)
-                b_direction = True
-
+                next_station.arrive_a(train, prev_station.station_id, prev_dir)
+
+    def _build_position_index(self):
+        """Maps each position of the loop travelled by the trains (b direction
+        outbound, a direction back) to a station index and direction"""
+        cycle_length = self.num_stations * Line.num_directions
+        positions = np.arange(cycle_length)
+        is_b = positions < self.num_stations
+        self.position_station = np.where(is_b, positions, cycle_length - positions)
+        self.position_station = self.position_station.tolist()
+        self.position_b = is_b.tolist()
+
+    def _get_position(self, index, b_direction):
+        """Returns the loop position of a station index and direction"""
         if b_direction is True:
-            return self.stations[curr_index].b_train, curr_index, True
-        return self.stations[curr_index].a_train, curr_index, False
-
-    def _next_train_b(self, start_index, step_size):
-        """Finds the next train in the b direction, if any"""
-        for i in range(start_index, len(self.stations), step_size):
-            if self.stations[i].b_train is not None:
-                return i
-        return -1
-
-    def _next_train_a(self, start_index, step_size):
-        """Finds the next train in the a direction, if any"""
-        for i in range(start_index, 0, -step_size):
-            if self.stations[i].a_train is not None:
-                return i
-        return -1
+            return index
+        return len(self.position_station) - index
 
     def _get_next_idx(self, curr_index, b_direction, step_size=None):
         """Calculates the next station index. Returns next index and if it is b direction"""
@@ -0,0 +1,97 @@
+"""Defines the transit networks a simulation can run on"""
+from enum import IntEnum
+import logging
+
+import numpy as np
+
+from models.line import Line
+from models.topology import load_topology
+
+
+logger = logging.getLogger(__name__)
+
+
+class Network:
+    """The lines, stations and ridership seeds of a simulated network
+
+    `stations` maps each line color name to its ordered chain of
+    `(station_id, station_name)` pairs. `ridership` maps each station id to its
+    average weekday, saturday and sunday rides, and `hour_ratios` holds the
+    share of daily riders for every hour of the day.
+    """
+
+    def __init__(
+        self, colors, lines, stations, ridership, hour_ratios, trains_per_line, recipe
+    ):
+        self.colors = colors
+        self.lines = lines
+        self.stations = stations
+        self.ridership = ridership
+        self.hour_ratios = hour_ratios
+        self.trains_per_line = trains_per_line
+        # Function and arguments that rebuild this network, used for pickling
+        self.recipe = recipe
+
+    def __reduce__(self):
+        # Line color enums cannot be pickled, so worker processes rebuild the
+        # network instead. Generated networks are deterministic given a seed.
+        return self.recipe
+
+    def line_stations(self, color):
+        """Returns the ordered `(station_id, station_name)` pairs of a line"""
+        return self.stations[color.name]
+
+
+def load_cta_network():
+    """Loads the CTA "L" network from the precompiled station data"""
+    topology = load_topology()
+    return Network(
+        colors=Line.colors,
+        lines=[Line.colors.blue, Line.colors.red, Line.colors.green],
+        stations=topology["lines"],
+        ridership=topology["ridership"],
+        hour_ratios=topology["hour_ratios"],
+        trains_per_line=10,
+        recipe=(load_cta_network, ()),
+    )
+
+
+def generate_network(num_lines, stations_per_line, trains_per_line, seed=0):
+    """Synthesizes a network of `num_lines` lines with `stations_per_line`
+    stations each. Station ridership is resampled from `ridership_seed.csv`, so
+    the synthetic stations follow the distribution of the real ones."""
+    logger.info(
+        f"Generating network: {num_lines} lines x {stations_per_line} stations, "
+        f"{trains_per_line} trains per line"
+    )
+    rng = np.random.default_rng(seed)
+    color_names = [f"line_{i:03d}" for i in range(num_lines)]
+    colors = IntEnum("colors", color_names, start=0)
+
+    topology = load_topology()
+    real_ridership = list(topology["ridership"].values())
+    samples = rng.integers(0, len(real_ridership), size=num_lines * stations_per_line)
+
+    stations = {}
+    ridership = {}
+    station_id = 100000
+    for line, name in enumerate(color_names):
+        chain = []
+        for stop in range(stations_per_line):
+            chain.append((station_id, f"Line {line:03d} Station {stop:05d}"))
+            ridership[station_id] = real_ridership[samples[len(ridership)]]
+            station_id += 1
+        stations[name] = chain
+
+    return Network(
+        colors=colors,
+        lines=list(colors),
+        stations=stations,
+        ridership=ridership,
+        hour_ratios=topology["hour_ratios"],
+        trains_per_line=trains_per_line,
+        recipe=(
+            generate_network,
+            (num_lines, stations_per_line, trains_per_line, seed),
+        ),
+    )
@@ -1,11 +1,20 @@
 """Producer base-class providing common utilites and functionality"""
+from concurrent.futures import wait
+from contextlib import contextmanager
+import datetime
+from functools import partial
 import logging
+import threading
 import time
 
+from confluent_kafka import KafkaError, KafkaException
 from confluent_kafka.admin import AdminClient, NewTopic
 from confluent_kafka.avro import AvroProducer
 
-from config import Connections
+from config import Connections, ProducerSettings
+from models.telemetry import ProducerTelemetry
+from recording import SegmentRecorder
+import transport
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +24,20 @@ class Producer:
 
     # Tracks existing topics across all Producer instances
     existing_topics = set()
+    # Topics requested, and records produced, while topic creation is deferred.
+    # See `deferred_topic_creation`
+    pending_topics = None
+    pending_records = []
+    # Simulated event time in milliseconds, used instead of the wall clock when set
+    event_time_ms = None
+    # Kafka clients shared by all Producer instances in this process
+    pool = []
+    pool_index = 0
+    admin_client = None
+    # Records every produced event when set, see `start_recording`
+    recorder = None
+    # Delivery counts, latencies and client statistics of this process
+    telemetry = ProducerTelemetry()
 
     def __init__(
         self,
@@ -30,55 +53,129 @@ class Producer:
         self.value_schema = value_schema
         self.num_partitions = num_partitions
         self.num_replicas = num_replicas
-        self._client = None
-        self.broker_properties = {
+        self.producer = Producer.pooled_producer()
+
+        # If the topic does not already exist, try to create it
+        if self.topic_name not in Producer.existing_topics:
+            if Producer.pending_topics is not None:
+                Producer.pending_topics.setdefault(self.topic_name, self.new_topic())
+            else:
+                self.create_topic()
+                Producer.existing_topics.add(self.topic_name)
+
+    @classmethod
+    def broker_properties(cls):
+        """Returns the librdkafka configuration used by the pooled producers"""
+        properties = {
             "bootstrap.servers": Connections.KAFKA_BROKER,
             "schema.registry.url": Connections.SCHEMA_REGISTRY,
-            "on_delivery": delivery_report,
+            "on_delivery": cls.telemetry.on_delivery,
+            "linger.ms": ProducerSettings.LINGER_MS,
+            "batch.num.messages": ProducerSettings.BATCH_NUM_MESSAGES,
+            "queue.buffering.max.messages": ProducerSettings.QUEUE_BUFFERING_MAX_MESSAGES,
+            "compression.type": ProducerSettings.COMPRESSION_TYPE,
         }
+        if ProducerSettings.STATS_INTERVAL_MS > 0:
+            properties["statistics.interval.ms"] = ProducerSettings.STATS_INTERVAL_MS
+            properties["stats_cb"] = cls.telemetry.on_stats
+        return properties
 
-        self.producer = AvroProducer(
-            self.broker_properties,
-            default_key_schema=self.key_schema,
-            default_value_schema=self.value_schema,
-        )
+    @classmethod
+    def pooled_producer(cls) -> AvroProducer:
+        """Hands out the process-wide AvroProducers in round-robin order"""
+        if not cls.pool:
+            logger.info(f"Creating {ProducerSettings.POOL_SIZE} pooled producer(s)")
+            cls.pool = [
+                cls.new_client() for _ in range(max(ProducerSettings.POOL_SIZE, 1))
+            ]
+        producer = cls.pool[cls.pool_index % len(cls.pool)]
+        cls.pool_index += 1
+        return producer
 
-        # If the topic does not already exist, try to create it
-        if self.topic_name not in Producer.existing_topics:
-            self.create_topic()
-            Producer.existing_topics.add(self.topic_name)
+    @classmethod
+    def new_client(cls) -> AvroProducer:
+        """Creates a producer client for the configured transport backend"""
+        if transport.uses_kafka():
+            return AvroProducer(cls.broker_properties())
+        return transport.TransportProducer(transport.broker(), cls.broker_properties())
+
+    @classmethod
+    def drain(cls, max_queued):
+        """Serves delivery callbacks until every pooled producer has at most
+        `max_queued` messages waiting for delivery"""
+        for producer in cls.pool:
+            while len(producer) > max_queued:
+                producer.poll(0.1)
+
+    @classmethod
+    def admin(cls) -> AdminClient:
+        """Returns the AdminClient shared by all Producer instances"""
+        if not cls.admin_client:
+            if transport.uses_kafka():
+                cls.admin_client = AdminClient(
+                    {"bootstrap.servers": Connections.KAFKA_BROKER}
+                )
+            else:
+                cls.admin_client = transport.TransportAdminClient(transport.broker())
+        return cls.admin_client
 
     @property
     def client(self) -> AdminClient:
-        if not self._client:
-            self._client = AdminClient(
-                {"bootstrap.servers": self.broker_properties["bootstrap.servers"]}
-            )
-        return self._client
+        return Producer.admin()
 
-    def create_topic(self):
-        """Creates the producer topic if it does not already exist"""
+    @classmethod
+    @contextmanager
+    def deferred_topic_creation(cls):
+        """Collects the topics of Producers built inside the block and creates the
+        missing ones in a single batch when the block exits"""
+        cls.pending_topics = {}
+        cls.pending_records = []
+        try:
+            yield
+            new_topics = list(cls.pending_topics.values())
+        finally:
+            cls.pending_topics = None
+        cls.create_topics(new_topics)
 
-        if self.topic_exists(self.topic_name):
-            logger.debug(f"Topic already exists: {self.topic_name}")
-            return
+        pending_records, cls.pending_records = cls.pending_records, []
+        for producer, key, value in pending_records:
+            producer.produce(key, value)
 
-        futures = self.client.create_topics(
-            [
-                NewTopic(
-                    self.topic_name,
-                    num_partitions=self.num_partitions,
-                    replication_factor=self.num_replicas,
-                )
-            ]
+    @classmethod
+    def create_topics(cls, new_topics):
+        """Creates the given topics that do not exist yet, fetching the cluster
+        metadata once and issuing one `create_topics` request"""
+        cluster_topics = cls.admin().list_topics(timeout=5.0).topics
+        missing = [topic for topic in new_topics if topic.topic not in cluster_topics]
+        if missing:
+            logger.info(f"Creating {len(missing)} topic(s)")
+            futures = cls.admin().create_topics(missing)
+            wait(list(futures.values()))
+            for topic, future in futures.items():
+                try:
+                    future.result()
+                    logger.debug(f"Topic created: {topic}")
+                except KafkaException as exc:
+                    if exc.args[0].code() == KafkaError.TOPIC_ALREADY_EXISTS:
+                        # Created concurrently, e.g. by another simulation shard
+                        logger.debug(f"Topic already exists: {topic}")
+                    else:
+                        logger.error(f"Failed to create topic {topic}: {exc}")
+                except Exception as exc:
+                    logger.error(f"Failed to create topic {topic}: {exc}")
+        cls.existing_topics.update(topic.topic for topic in new_topics)
+
+    def new_topic(self) -> NewTopic:
+        """Describes the topic this producer writes to"""
+        return NewTopic(
+            self.topic_name,
+            num_partitions=self.num_partitions,
+            replication_factor=self.num_replicas,
         )
 
-        for topic, future in futures.items():
-            try:
-                future.result()
-                logger.debug(f"Topic created: {topic}")
-            except Exception as exc:
-                logger.error(f"Failed to create topic {topic}: {exc}")
+    def create_topic(self):
+        """Creates the producer topic if it does not already exist"""
+        Producer.create_topics([self.new_topic()])
 
     def topic_exists(self, topic: str) -> bool:
         """Check if the topic exists in the Kafka"""
@@ -86,18 +183,125 @@ class Producer:
         topics = cluster_metadata.topics
         return topic in topics
 
+    def produce(self, key, value):
+        """Serves pending delivery callbacks and enqueues a record on this topic"""
+        if Producer.pending_topics is not None:
+            # Hold the record until its topic has been created
+            Producer.pending_records.append((self, key, value))
+            return
+        timestamp = self.time_millis()
+        self.producer.poll(0)
+        if self._enqueue(key, value, timestamp):
+            Producer.telemetry.produced(self.topic_name)
+            self.record(key, value, timestamp)
+
+    def _enqueue(self, key, value, timestamp):
+        """Hands the record to the client. When its local queue is full, either
+        serves delivery callbacks until there is room, for at most
+        `BACKPRESSURE_MAX_BLOCK_S`, or sheds the record straight away, depending
+        on `ProducerSettings.BACKPRESSURE`. Returns False if the record was shed."""
+        blocked_since = None
+        while True:
+            try:
+                self.producer.produce(
+                    topic=self.topic_name,
+                    key=key,
+                    value=value,
+                    key_schema=self.key_schema,
+                    value_schema=self.value_schema,
+                    timestamp=timestamp,
+                )
+                break
+            except BufferError:
+                if ProducerSettings.BACKPRESSURE == "shed":
+                    Producer.telemetry.on_shed(self.topic_name)
+                    return False
+                now = time.monotonic()
+                if blocked_since is None:
+                    blocked_since = now
+                elif now - blocked_since >= ProducerSettings.BACKPRESSURE_MAX_BLOCK_S:
+                    Producer.telemetry.on_blocked(self.topic_name, now - blocked_since)
+                    Producer.telemetry.on_shed(self.topic_name)
+                    return False
+                self.producer.poll(ProducerSettings.BACKPRESSURE_POLL_S)
+        if blocked_since is not None:
+            Producer.telemetry.on_blocked(
+                self.topic_name, time.monotonic() - blocked_since
+            )
+        return True
+
+    def record(self, key, value, timestamp):
+        """Adds a produced event to the recording, if one is in progress"""
+        if Producer.recorder is not None:
+            Producer.recorder.record(
+                self.topic_name,
+                timestamp,
+                key,
+                value,
+                key_schema=self.key_schema,
+                value_schema=self.value_schema,
+            )
+
+    @classmethod
+    def start_recording(cls, directory):
+        """Records every event produced from now on to segments in `directory`"""
+        cls.recorder = SegmentRecorder(directory)
+
+    @classmethod
+    def stop_recording(cls):
+        """Writes out and closes the recording, if one is in progress"""
+        if cls.recorder is not None:
+            cls.recorder.close()
+            logger.info(f"Recorded {cls.recorder.num_records} event(s)")
+            cls.recorder = None
+
     def close(self):
         """Prepares the producer for exit by cleaning up the producer"""
         self.producer.flush()
 
+    @classmethod
+    def shutdown(cls, timeout=None, flushes=()):
+        """Flushes every pooled client, and runs the extra `flushes` callables,
+        concurrently on daemon threads. Gives up on whatever has not finished
+        once `timeout` (`ProducerSettings.SHUTDOWN_TIMEOUT_S` by default) passed,
+        so an unreachable broker cannot hang the exit. Returns, and logs, the
+        number of records left undelivered per topic."""
+        if timeout is None:
+            timeout = ProducerSettings.SHUTDOWN_TIMEOUT_S
+        deadline = time.monotonic() + timeout
+        tasks = [partial(client.flush, timeout) for client in cls.pool]
+        tasks.extend(flushes)
+        threads = [
+            threading.Thread(target=task, name=f"shutdown-flush-{i}", daemon=True)
+            for i, task in enumerate(tasks)
+        ]
+        logger.info(f"Flushing {len(threads)} client(s), waiting up to {timeout}s")
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+        stuck = sum(thread.is_alive() for thread in threads)
+        if stuck:
+            logger.warning(f"{stuck} client(s) still flushing after {timeout}s")
+        undelivered = cls.telemetry.undelivered()
+        for topic_name, num_records in sorted(undelivered.items()):
+            logger.warning(f"{num_records} record(s) to {topic_name} undelivered")
+        return undelivered
+
+    @classmethod
+    def set_event_time(cls, event_time):
+        """Stamps subsequent events with the given naive UTC datetime, or with the
+        wall clock again when `event_time` is None"""
+        if event_time is None:
+            cls.event_time_ms = None
+            return
+        event_time = event_time.replace(tzinfo=datetime.timezone.utc)
+        cls.event_time_ms = int(round(event_time.timestamp() * 1000))
+
     def time_millis(self):
         """Use this function to get the key for Kafka Events"""
+        if Producer.event_time_ms is not None:
+            return Producer.event_time_ms
         return int(round(time.time() * 1000))
 
-
-def delivery_report(err, msg):
-    """Callback on message delivery result"""
-    if err is not None:
-        logger.error(f"Message delivery failed: {err}")
-    else:
-        logger.debug(f"Message delivered to {msg.topic()}[{msg.partition()}]")
@@ -0,0 +1,99 @@
+"""Produces records through the Kafka REST Proxy"""
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Connections, ProducerSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+class RestProxyClient:
+    """Sends Avro records for one topic to the Kafka REST Proxy
+
+    Records are buffered until `batch_size` of them are pending and then sent in
+    a single request over a keep-alive session shared by all clients. After the
+    first successful request the schema ids returned by the proxy are sent in
+    place of the full schemas.
+    """
+
+    content_type = "application/vnd.kafka.avro.v2+json"
+    # HTTP session shared by all clients in this process
+    session = None
+
+    def __init__(
+        self, topic_name, key_schema, value_schema, batch_size=None, telemetry=None
+    ):
+        self.topic_name = topic_name
+        self.url = f"{Connections.REST_PROXY}/topics/{topic_name}"
+        self.key_schema = json.dumps(key_schema.to_json())
+        self.value_schema = json.dumps(value_schema.to_json())
+        self.key_schema_id = None
+        self.value_schema_id = None
+        self.batch_size = batch_size
+        if self.batch_size is None:
+            self.batch_size = ProducerSettings.REST_PROXY_BATCH_SIZE
+        self.records = []
+        # Optional ProducerTelemetry the request results are counted in
+        self.telemetry = telemetry
+
+    @classmethod
+    def shared_session(cls) -> requests.Session:
+        """Returns the pooled keep-alive HTTP session"""
+        if cls.session is None:
+            adapter = HTTPAdapter(pool_maxsize=ProducerSettings.REST_PROXY_POOL_SIZE)
+            cls.session = requests.Session()
+            cls.session.mount("http://", adapter)
+            cls.session.mount("https://", adapter)
+            cls.session.headers.update({"Content-Type": cls.content_type})
+        return cls.session
+
+    def produce(self, key, value):
+        """Buffers a record, sending the batch once it is full"""
+        self.records.append({"key": key, "value": value})
+        if self.telemetry is not None:
+            self.telemetry.produced(self.topic_name)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Sends all buffered records in one request"""
+        if not self.records:
+            return
+        payload = {"records": self.records}
+        if self.key_schema_id is None:
+            payload["key_schema"] = self.key_schema
+        else:
+            payload["key_schema_id"] = self.key_schema_id
+        if self.value_schema_id is None:
+            payload["value_schema"] = self.value_schema
+        else:
+            payload["value_schema_id"] = self.value_schema_id
+        num_records, self.records = len(self.records), []
+
+        try:
+            resp = RestProxyClient.shared_session().post(
+                self.url,
+                data=json.dumps(payload),
+                timeout=ProducerSettings.REST_PROXY_TIMEOUT_S,
+            )
+            resp.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            logger.error(f"Message delivered via REST Proxy failed: {err}")
+            if self.telemetry is not None:
+                self.telemetry.topic(self.topic_name).failed += num_records
+            return
+        if self.telemetry is not None:
+            self.telemetry.topic(self.topic_name).delivered += num_records
+
+        result = resp.json()
+        self.key_schema_id = result.get("key_schema_id") or self.key_schema_id
+        self.value_schema_id = result.get("value_schema_id") or self.value_schema_id
+        logger.debug("sent %s record(s) via REST Proxy to %s", num_records, self.url)
+
+    def close(self):
+        """Sends any records still buffered"""
+        self.flush()
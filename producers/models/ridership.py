@@ -0,0 +1,58 @@
+"""Draws turnstile entries for every station of the simulation in one step"""
+import logging
+
+import numpy as np
+
+from models.topology import load_topology
+
+
+logger = logging.getLogger(__name__)
+
+
+class RidershipEngine:
+    """Batched equivalent of calling TurnstileHardware.get_entries per station"""
+
+    # Bounds of the random noise added to each entry count, upper bound excluded
+    noise_low = -5
+    noise_high = 5
+
+    def __init__(self, station_ids, seed=None, ridership=None, hour_ratios=None):
+        """Precomputes the hourly curve and the station x daytype ridership.
+        Both come from the compiled station data unless they are given."""
+        if ridership is None or hour_ratios is None:
+            topology = load_topology()
+            ridership = topology["ridership"] if ridership is None else ridership
+            hour_ratios = (
+                topology["hour_ratios"] if hour_ratios is None else hour_ratios
+            )
+        self.hour_ratios = np.array(hour_ratios, dtype=float)
+
+        missing = [sid for sid in station_ids if sid not in ridership]
+        if missing:
+            logger.warning(f"No ridership seed for stations {missing}, using 0")
+        self.ridership = np.rint(
+            np.array(
+                [ridership.get(sid, (0.0, 0.0, 0.0)) for sid in station_ids],
+                dtype=float,
+            ).reshape(-1, 3)
+        )
+        self.rng = np.random.default_rng(seed)
+
+    @staticmethod
+    def daytype(timestamp):
+        """Returns the ridership column for the day: weekday, saturday or sunday"""
+        dow = timestamp.weekday()
+        if dow < 5:
+            return 0
+        return 1 if dow == 5 else 2
+
+    def get_entries(self, timestamp, time_step):
+        """Returns the number of turnstile entries for every station"""
+        total_steps = int(60 / (60 / time_step.total_seconds()))
+        ratio = self.hour_ratios[timestamp.hour]
+        riders = self.ridership[:, self.daytype(timestamp)]
+        entries = np.floor(riders * ratio / total_steps).astype(np.int64)
+        entries += self.rng.integers(
+            RidershipEngine.noise_low, RidershipEngine.noise_high, size=len(entries)
+        )
+        return np.maximum(entries, 0)
@@ -1,7 +1,7 @@
 """Methods pertaining to loading and configuring CTA "L" station data."""
 import logging
 
-from config import join_topic_name, CtaTopics
+from config import join_topic_name, CtaTopics, TopicSettings
 from models import Turnstile
 from models.producer import Producer
 from models.utils import load_schema, normalize_station_name, RecordSchema
@@ -14,6 +14,7 @@ class Station(Producer):
     """Defines a single station"""
 
     key_schema: RecordSchema = load_schema("arrival_key.json")
+    station_key_schema: RecordSchema = load_schema("station_key.json")
     value_schema: RecordSchema = load_schema("arrival_value.json")
 
     def __init__(self, station_id, name, color, direction_a=None, direction_b=None):
@@ -26,22 +27,40 @@ class Station(Producer):
         self.b_train = None
         self.turnstile = Turnstile(self)
 
-        station_name = normalize_station_name(self.name)
-        topic_name = join_topic_name(CtaTopics.ARRIVALS_PREFIX, station_name)
-        super().__init__(
-            topic_name=topic_name,
-            key_schema=Station.key_schema,
-            value_schema=Station.value_schema,
-            num_partitions=3,
-            num_replicas=1,
+        # Consolidated arrivals are always keyed by station, so that every
+        # station's arrivals stay ordered within one partition of the shared topic
+        self.station_keyed = (
+            TopicSettings.CONSOLIDATED_ARRIVALS or TopicSettings.STATION_KEYED_RECORDS
         )
+        key_schema = Station.key_schema
+        if self.station_keyed is True:
+            key_schema = Station.station_key_schema
+        if TopicSettings.CONSOLIDATED_ARRIVALS is True:
+            super().__init__(
+                topic_name=CtaTopics.ARRIVALS,
+                key_schema=key_schema,
+                value_schema=Station.value_schema,
+                num_partitions=TopicSettings.ARRIVALS_PARTITIONS,
+                num_replicas=1,
+            )
+        else:
+            station_name = normalize_station_name(self.name)
+            super().__init__(
+                topic_name=join_topic_name(CtaTopics.ARRIVALS_PREFIX, station_name),
+                key_schema=key_schema,
+                value_schema=Station.value_schema,
+                num_partitions=3,
+                num_replicas=1,
+            )
 
     def run(self, train, direction, prev_station_id, prev_direction):
         """Simulates train arrivals at this station"""
-        self.producer.poll(0)
-        self.producer.produce(
-            topic=self.topic_name,
-            key={"timestamp": self.time_millis()},
+        if self.station_keyed is True:
+            key = {"station_id": self.station_id}
+        else:
+            key = {"timestamp": self.time_millis()}
+        self.produce(
+            key=key,
             value={
                 "station_id": self.station_id,
                 "train_id": train.train_id,
@@ -0,0 +1,186 @@
+"""Aggregates delivery telemetry of the producers in this process"""
+from bisect import bisect_left
+import json
+import logging
+import time
+
+from config import ProducerSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+class TopicStats:
+    """Counters and delivery latency histogram of one topic"""
+
+    # Upper bounds of the latency histogram buckets in milliseconds, the last
+    # bucket counts everything slower
+    latency_bounds_ms = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+        # Records dropped because the local queue stayed full, and how often and
+        # for how long producing waited for room in it
+        self.shed = 0
+        self.blocked = 0
+        self.blocked_s = 0.0
+        self.latency_counts = [0] * (len(TopicStats.latency_bounds_ms) + 1)
+
+    def add_latency(self, latency_s):
+        bucket = bisect_left(TopicStats.latency_bounds_ms, latency_s * 1000.0)
+        self.latency_counts[bucket] += 1
+
+    def latency_quantile_ms(self, quantile):
+        """Returns the upper bound of the bucket holding the given quantile, or
+        None if no latency was recorded or it falls in the last bucket"""
+        total = sum(self.latency_counts)
+        if total == 0:
+            return None
+        seen = 0
+        for bound, count in zip(TopicStats.latency_bounds_ms, self.latency_counts):
+            seen += count
+            if seen >= quantile * total:
+                return bound
+        return None
+
+    @property
+    def undelivered(self):
+        """Records handed to a client that were neither delivered nor failed yet"""
+        return self.produced - self.delivered - self.failed
+
+    def to_dict(self):
+        return {
+            "produced": self.produced,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "shed": self.shed,
+            "blocked": self.blocked,
+            "blocked_s": self.blocked_s,
+            "latency_ms": {
+                "bounds": list(TopicStats.latency_bounds_ms),
+                "counts": list(self.latency_counts),
+                "p50": self.latency_quantile_ms(0.5),
+                "p99": self.latency_quantile_ms(0.99),
+            },
+        }
+
+
+class ProducerTelemetry:
+    """Tracks produced, delivered and failed records per topic, their delivery
+    latency, and the client queue and broker round trip times reported by
+    librdkafka statistics. A summary is logged every `TELEMETRY_SUMMARY_S`."""
+
+    def __init__(self):
+        self.topics = {}
+        # Latest librdkafka statistics per client: queued messages and the
+        # average broker round trip time in milliseconds per broker
+        self.queue_lengths = {}
+        self.broker_rtt_ms = {}
+        self.last_summary = time.monotonic()
+        self.failures_logged = set()
+        self.sheds_logged = set()
+
+    def topic(self, topic_name) -> TopicStats:
+        stats = self.topics.get(topic_name)
+        if stats is None:
+            stats = self.topics[topic_name] = TopicStats()
+        return stats
+
+    def produced(self, topic_name, num_records=1):
+        self.topic(topic_name).produced += num_records
+
+    def undelivered(self):
+        """Returns the topics with records still awaiting delivery and their count"""
+        return {
+            name: stats.undelivered
+            for name, stats in self.topics.items()
+            if stats.undelivered > 0
+        }
+
+    def on_delivery(self, err, msg):
+        """Delivery callback of the pooled producers"""
+        stats = self.topic(msg.topic())
+        if err is not None:
+            stats.failed += 1
+            # Only the first failure of a topic per summary is logged, the
+            # summary reports the total
+            if msg.topic() not in self.failures_logged:
+                self.failures_logged.add(msg.topic())
+                logger.error(f"Message delivery to {msg.topic()} failed: {err}")
+            return
+        stats.delivered += 1
+        latency = msg.latency()
+        if latency is not None:
+            stats.add_latency(latency)
+
+    def on_blocked(self, topic_name, blocked_s):
+        """Counts a produce call that waited for room in the local queue"""
+        stats = self.topic(topic_name)
+        stats.blocked += 1
+        stats.blocked_s += blocked_s
+
+    def on_shed(self, topic_name):
+        """Counts a record dropped because the local queue was full"""
+        self.topic(topic_name).shed += 1
+        if topic_name not in self.sheds_logged:
+            self.sheds_logged.add(topic_name)
+            logger.warning(f"Local producer queue full, shedding {topic_name} records")
+
+    def on_stats(self, stats_json):
+        """Statistics callback of the pooled producers"""
+        stats = json.loads(stats_json)
+        self.queue_lengths[stats["name"]] = stats["msg_cnt"]
+        for broker in stats.get("brokers", {}).values():
+            rtt = broker.get("rtt", {})
+            if rtt.get("cnt"):
+                self.broker_rtt_ms[broker["name"]] = rtt["avg"] / 1000.0
+
+    def snapshot(self):
+        """Returns all telemetry as a JSON serializable dict"""
+        return {
+            "topics": {name: stats.to_dict() for name, stats in self.topics.items()},
+            "queue_lengths": dict(self.queue_lengths),
+            "broker_rtt_ms": dict(self.broker_rtt_ms),
+        }
+
+    def maybe_log_summary(self):
+        """Logs the summary if `TELEMETRY_SUMMARY_S` passed since the last one"""
+        if time.monotonic() - self.last_summary >= ProducerSettings.TELEMETRY_SUMMARY_S:
+            self.log_summary()
+
+    def log_summary(self):
+        self.last_summary = time.monotonic()
+        self.failures_logged.clear()
+        self.sheds_logged.clear()
+        produced = sum(stats.produced for stats in self.topics.values())
+        delivered = sum(stats.delivered for stats in self.topics.values())
+        failed = sum(stats.failed for stats in self.topics.values())
+        shed = sum(stats.shed for stats in self.topics.values())
+        blocked_s = sum(stats.blocked_s for stats in self.topics.values())
+        logger.info(
+            f"producer telemetry: {produced} produced, {delivered} delivered, "
+            f"{failed} failed, {shed} shed, {blocked_s:.1f}s blocked "
+            f"across {len(self.topics)} topic(s), "
+            f"queued {sum(self.queue_lengths.values())}, "
+            f"broker rtt ms {self.broker_rtt_ms}"
+        )
+        for name, stats in sorted(self.topics.items()):
+            line = (
+                f"{name}: {stats.produced} produced, {stats.delivered} delivered, "
+                f"{stats.failed} failed, {stats.shed} shed, latency ms "
+                f"p50 {stats.latency_quantile_ms(0.5)} "
+                f"p99 {stats.latency_quantile_ms(0.99)}"
+            )
+            if stats.failed or stats.shed:
+                logger.warning(line)
+            else:
+                logger.debug(line)
+
+        if ProducerSettings.TELEMETRY_FILE is not None:
+            try:
+                with open(ProducerSettings.TELEMETRY_FILE, "w") as telemetry_file:
+                    json.dump(self.snapshot(), telemetry_file)
+            except OSError as exc:
+                logger.warning(f"Unable to write producer telemetry: {exc}")
@@ -0,0 +1,106 @@
+"""Precompiles the CTA station and ridership CSVs into a fast-loading artifact"""
+import csv
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parents[1] / "data"
+SOURCE_FILES = ("cta_stations.csv", "ridership_curve.csv", "ridership_seed.csv")
+CACHE_FILE = DATA_DIR / "topology.cache.json"
+# Bump when the artifact layout changes to invalidate existing caches
+CACHE_VERSION = 1
+
+LINE_COLORS = ("blue", "green", "red")
+RIDERSHIP_COLUMNS = (
+    "avg_weekday_rides",
+    "avg_saturday_rides",
+    "avg_sunday-holiday_rides",
+)
+
+
+def source_hashes():
+    """Returns the sha256 digest of every source CSV"""
+    return {
+        name: hashlib.sha256((DATA_DIR / name).read_bytes()).hexdigest()
+        for name in SOURCE_FILES
+    }
+
+
+def read_rows(name):
+    """Reads a source CSV into a list of dicts"""
+    with open(DATA_DIR / name, newline="") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def build_topology():
+    """Compiles the CSVs into plain data: the ordered station chain of every
+    line, the ridership seeds of every station and the hourly ridership curve"""
+    station_rows = read_rows("cta_stations.csv")
+    station_rows.sort(key=lambda row: int(row["order"]))
+    lines = {}
+    for color in LINE_COLORS:
+        chain = {}
+        for row in station_rows:
+            if row[color] == "TRUE":
+                chain.setdefault(row["station_name"], int(row["station_id"]))
+        lines[color] = [[station_id, name] for name, station_id in chain.items()]
+
+    ridership = {}
+    for row in read_rows("ridership_seed.csv"):
+        ridership.setdefault(
+            row["station_id"], [float(row[column]) for column in RIDERSHIP_COLUMNS]
+        )
+
+    hour_ratios = [0.0] * 24
+    for row in read_rows("ridership_curve.csv"):
+        # The curve also lists hour 24, which a timestamp never reaches
+        if int(row["hour"]) < len(hour_ratios):
+            hour_ratios[int(row["hour"])] = float(row["ridership_ratio"])
+
+    return {"lines": lines, "ridership": ridership, "hour_ratios": hour_ratios}
+
+
+def load_topology():
+    """Loads the compiled topology, rebuilding the cache if any CSV changed"""
+    hashes = source_hashes()
+    try:
+        with open(CACHE_FILE) as cache_file:
+            cached = json.load(cache_file)
+        if cached["version"] == CACHE_VERSION and cached["sources"] == hashes:
+            return _from_json(cached["topology"])
+        logger.info("Station data changed, rebuilding topology cache")
+    except (OSError, ValueError, KeyError):
+        logger.info("Building topology cache")
+
+    topology = build_topology()
+    try:
+        tmp_file = CACHE_FILE.with_suffix(".tmp")
+        with open(tmp_file, "w") as cache_file:
+            json.dump(
+                {"version": CACHE_VERSION, "sources": hashes, "topology": topology},
+                cache_file,
+            )
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError as exc:
+        logger.warning(f"Unable to write topology cache {CACHE_FILE}: {exc}")
+    return _from_json(topology)
+
+
+def _from_json(topology):
+    """Restores the integer station ids JSON turned into strings"""
+    return {
+        "lines": {
+            color: [(station_id, name) for station_id, name in chain]
+            for color, chain in topology["lines"].items()
+        },
+        "ridership": {
+            int(station_id): tuple(rides)
+            for station_id, rides in topology["ridership"].items()
+        },
+        "hour_ratios": topology["hour_ratios"],
+    }
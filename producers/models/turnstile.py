@@ -1,10 +1,12 @@
 """Creates a turnstile data producer"""
+import json
 import logging
 
-from config import join_topic_name, CtaTopics
+from config import join_topic_name, CtaTopics, SimulationSettings, TopicSettings
 from models.producer import Producer
 from models.turnstile_hardware import TurnstileHardware
 from models.utils import load_schema, RecordSchema
+import transport
 
 
 logger = logging.getLogger(__name__)
@@ -12,34 +14,82 @@ logger = logging.getLogger(__name__)
 
 class Turnstile(Producer):
     key_schema: RecordSchema = load_schema("turnstile_key.json")
-    value_schema: RecordSchema = load_schema("turnstile_value.json")
+    station_key_schema: RecordSchema = load_schema("station_key.json")
+    value_schema: RecordSchema = load_schema("turnstile_value_v2.json")
+    # Entries counted per station id by every turnstile in this process, so that
+    # the turnstiles of a station served by several lines share one total. Shard
+    # processes each count only the lines they simulate
+    station_entries = {}
 
-    def __init__(self, station):
+    def __init__(self, station, aggregate=None):
         """Create the Turnstile"""
+        self.station_keyed = TopicSettings.STATION_KEYED_RECORDS
         super().__init__(
             topic_name=CtaTopics.TURNSTILES,
-            key_schema=Turnstile.key_schema,
+            key_schema=(
+                Turnstile.station_key_schema
+                if self.station_keyed is True
+                else Turnstile.key_schema
+            ),
             value_schema=Turnstile.value_schema,
             num_partitions=3,
             num_replicas=1,
         )
         self.station = station
-        self.turnstile_hardware = TurnstileHardware(station)
+        self.aggregate = aggregate
+        if self.aggregate is None:
+            self.aggregate = SimulationSettings.AGGREGATE_TURNSTILES
+        self._turnstile_hardware = None
+        # KSQL only runs against Kafka, so on other transports the turnstile
+        # publishes the running entry count of its station as KSQL would
+        self.summary = None
+        if not transport.uses_kafka():
+            self.summary = Producer(topic_name=CtaTopics.TURNSTILES_SUMMARY)
 
-    def run(self, timestamp, time_step):
+    @property
+    def turnstile_hardware(self) -> TurnstileHardware:
+        """Per-station ridership model, only built when entries are not supplied"""
+        if self._turnstile_hardware is None:
+            self._turnstile_hardware = TurnstileHardware(self.station)
+        return self._turnstile_hardware
+
+    def run(self, timestamp, time_step, num_entries=None):
         """Simulates riders entering through the turnstile."""
-        num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
+        if num_entries is None:
+            num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
         logger.debug(
             f"[{timestamp.isoformat()}] Riders count: {num_entries} @ {self.station.name}"
         )
-        for _ in range(num_entries):
-            self.producer.poll(0)
-            self.producer.produce(
-                topic=self.topic_name,
-                key={"timestamp": self.time_millis()},
-                value={
-                    "station_id": self.station.station_id,
-                    "station_name": self.station.name,
-                    "line": self.station.color.name,
-                },
-            )
+        if self.aggregate is True:
+            if num_entries > 0:
+                self._produce_entries(num_entries)
+        else:
+            for _ in range(num_entries):
+                self._produce_entries(1)
+        if self.summary is not None and num_entries > 0:
+            self._produce_summary(num_entries)
+
+    def _produce_entries(self, num_entries):
+        """Emits a turnstile event covering the given number of riders"""
+        if self.station_keyed is True:
+            key = {"station_id": self.station.station_id}
+        else:
+            key = {"timestamp": self.time_millis()}
+        self.produce(
+            key=key,
+            value={
+                "station_id": self.station.station_id,
+                "station_name": self.station.name,
+                "line": self.station.color.name,
+                "num_entries": num_entries,
+            },
+        )
+
+    def _produce_summary(self, num_entries):
+        """Emits the station-wide entry count, like KSQL's GROUP BY station_id"""
+        station_id = self.station.station_id
+        total = Turnstile.station_entries.get(station_id, 0) + num_entries
+        Turnstile.station_entries[station_id] = total
+        self.summary.produce(
+            key=None, value=json.dumps({"STATION_ID": station_id, "COUNT": total})
+        )
@@ -1,61 +1,40 @@
 import logging
 import math
-from pathlib import Path
 import random
 
-import pandas as pd
+from models.topology import load_topology
 
 
 logger = logging.getLogger(__name__)
 
 
 class TurnstileHardware:
-    curve_df = None
-    seed_df = None
+    topology = None
 
     def __init__(self, station):
         """Create the Turnstile"""
         self.station = station
         TurnstileHardware._load_data()
-        self.metrics_df = TurnstileHardware.seed_df[
-            TurnstileHardware.seed_df["station_id"] == station.station_id
-        ]
-        self.weekday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_weekday_rides"])
-        )
-        self.saturday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_saturday_rides"])
-        )
-        self.sunday_ridership = int(
-            round(self.metrics_df.iloc[0]["avg_sunday-holiday_rides"])
-        )
+        rides = TurnstileHardware.topology["ridership"][station.station_id]
+        self.weekday_ridership = int(round(rides[0]))
+        self.saturday_ridership = int(round(rides[1]))
+        self.sunday_ridership = int(round(rides[2]))
 
     @classmethod
     def _load_data(cls):
-        if cls.curve_df is None:
-            logger.info("Loading ridership_curve.csv")
-            cls.curve_df = pd.read_csv(
-                f"{Path(__file__).parents[1]}/data/ridership_curve.csv"
-            )
-        if cls.seed_df is None:
-            logger.info("Loading ridership_seed.csv")
-            cls.seed_df = pd.read_csv(
-                f"{Path(__file__).parents[1]}/data/ridership_seed.csv"
-            )
+        if cls.topology is None:
+            cls.topology = load_topology()
 
     def get_entries(self, timestamp, time_step):
         """Returns the number of turnstile entries for the given timeframe"""
-        hour_curve = TurnstileHardware.curve_df[
-            TurnstileHardware.curve_df["hour"] == timestamp.hour
-        ]
-        ratio = hour_curve.iloc[0]["ridership_ratio"]
+        ratio = TurnstileHardware.topology["hour_ratios"][timestamp.hour]
         total_steps = int(60 / (60 / time_step.total_seconds()))
 
         num_riders = 0
         dow = timestamp.weekday()
-        if dow >= 0 or dow < 5:
+        if dow < 5:
             num_riders = self.weekday_ridership
-        elif dow == 6:
+        elif dow == 5:
             num_riders = self.saturday_ridership
         else:
             num_riders = self.sunday_ridership
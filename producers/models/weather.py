@@ -1,14 +1,13 @@
 """Methods pertaining to weather data"""
 from enum import IntEnum
-import json
 import logging
 import random
 
-import requests
-
 from models.producer import Producer
+from models.rest_proxy import RestProxyClient
 from models.utils import load_schema, RecordSchema
-from config import Connections, CtaTopics
+from config import CtaTopics
+import transport
 
 
 logger = logging.getLogger(__name__)
@@ -21,8 +20,6 @@ class Weather(Producer):
         "status", "sunny partly_cloudy cloudy windy precipitation", start=0
     )
 
-    rest_proxy_url = Connections.REST_PROXY
-
     key_schema: RecordSchema = load_schema("weather_key.json")
     value_schema: RecordSchema = load_schema("weather_value.json")
 
@@ -37,6 +34,16 @@ class Weather(Producer):
             num_partitions=2,
             num_replicas=1,
         )
+        # Without Kafka there is no REST Proxy, so readings go through the
+        # transport producer instead
+        self.rest_proxy = None
+        if transport.uses_kafka():
+            self.rest_proxy = RestProxyClient(
+                self.topic_name,
+                Weather.key_schema,
+                Weather.value_schema,
+                telemetry=Producer.telemetry,
+            )
 
         self.status = Weather.status.sunny
         self.temp = 70.0
@@ -58,32 +65,21 @@ class Weather(Producer):
     def run(self, month):
         self._set_weather(month)
 
-        resp = requests.post(
-            f"{Weather.rest_proxy_url}/topics/{self.topic_name}",
-            headers={"Content-Type": "application/vnd.kafka.avro.v2+json"},
-            data=json.dumps(
-                {
-                    "key_schema": json.dumps(Weather.key_schema.to_json()),
-                    "value_schema": json.dumps(Weather.value_schema.to_json()),
-                    "records": [
-                        {
-                            "key": {"timestamp": self.time_millis()},
-                            "value": {
-                                "temperature": self.temp,
-                                "status": self.status.name,
-                            },
-                        }
-                    ],
-                }
-            ),
-        )
-        try:
-            resp.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            logger.error(f"Message delivered via REST Proxy failed: {err}")
-
+        key = {"timestamp": self.time_millis()}
+        value = {"temperature": self.temp, "status": self.status.name}
+        if self.rest_proxy is None:
+            self.produce(key=key, value=value)
+        else:
+            self.rest_proxy.produce(key=key, value=value)
+            self.record(key, value, key["timestamp"])
         logger.debug(
             "sent weather data to kafka, temp: %s, status: %s",
             self.temp,
             self.status.name,
         )
+
+    def close(self):
+        """Sends any buffered weather readings and flushes the producer"""
+        if self.rest_proxy is not None:
+            self.rest_proxy.close()
+        super().close()
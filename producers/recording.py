@@ -0,0 +1 @@
+../consumers/recording.py
\ No newline at end of file
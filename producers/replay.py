@@ -0,0 +1,65 @@
+"""Replays recorded event segments into Kafka, or the configured transport
+
+Usage: python replay.py SEGMENT_OR_DIRECTORY... [--speed N | --speed max]
+"""
+import logging
+import logging.config
+from pathlib import Path
+import time
+
+# Import logging before models to ensure configuration is picked up
+logging.config.fileConfig(Path(__file__).parents[0] / "logging.ini")  # noqa
+
+from confluent_kafka import avro
+
+from config import ProducerSettings
+from models.producer import Producer
+from recording import paced, parse_replay_args, read_segments
+
+
+logger = logging.getLogger(__name__)
+
+
+def replay(paths, speed=1.0):
+    """Produces every recorded event at `speed` times the recorded rate, or as
+    fast as possible when `speed` is None. Returns the number of events sent."""
+    producers = {}
+    num_records = 0
+    start = time.monotonic()
+    for record in paced(read_segments(paths), speed):
+        if record.value_schema is None:
+            # Records without a schema, like the station table, are not produced
+            # by the simulation but derived from its output downstream
+            continue
+        producer = producers.get(record.topic)
+        if producer is None:
+            producer = producers[record.topic] = Producer(
+                topic_name=record.topic,
+                key_schema=avro.loads(record.key_schema),
+                value_schema=avro.loads(record.value_schema),
+            )
+        # Stamp the record with its recorded event time
+        Producer.event_time_ms = record.event_ms
+        producer.produce(key=record.key, value=record.value)
+        num_records += 1
+        if speed is None and num_records % ProducerSettings.BATCH_NUM_MESSAGES == 0:
+            Producer.drain(ProducerSettings.UNTHROTTLED_MAX_QUEUED)
+
+    Producer.set_event_time(None)
+    for client in Producer.pool:
+        client.flush()
+    Producer.telemetry.log_summary()
+    elapsed = time.monotonic() - start
+    logger.info(
+        f"Replayed {num_records} event(s) in {elapsed:.1f}s "
+        f"({num_records / max(elapsed, 1e-9):,.0f} events/s)"
+    )
+    return num_records
+
+
+if __name__ == "__main__":
+    args = parse_replay_args(__doc__.splitlines()[0])
+    try:
+        replay(args.paths, args.speed)
+    except KeyboardInterrupt:
+        logger.info("replay interrupted")
@@ -0,0 +1,150 @@
+"""Runs the simulated lines across several worker processes"""
+import datetime
+import logging
+import multiprocessing
+import signal
+from threading import BrokenBarrierError
+import time
+
+from config import ProducerSettings, SimulationSettings
+from models.producer import Producer
+from simulation import TimeSimulation
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationShard(TimeSimulation):
+    """Simulates a subset of the lines inside a worker process"""
+
+    def _build_weather(self):
+        """Weather is owned by the coordinating process"""
+        self.weather = None
+
+
+class ShardedTimeSimulation(TimeSimulation):
+    """Coordinates shard worker processes so they advance one tick at a time
+
+    Every tick the coordinator publishes the simulated time, then meets the
+    workers at a shared barrier twice: once to start the tick and once when all
+    of them have finished it. Weather and clock pacing stay in the coordinator.
+    A shard that does not reach the barrier within `SHARD_TIMEOUT_S` breaks it
+    and stops the simulation.
+    """
+
+    # Time a shard gets on top of its own flush deadline to exit before the
+    # coordinator terminates it
+    shutdown_grace_s = 5.0
+
+    def __init__(self, num_shards=None, **kwargs):
+        self.num_shards = num_shards
+        if self.num_shards is None:
+            self.num_shards = SimulationSettings.NUM_SHARDS
+        self.workers = []
+        super().__init__(**kwargs)
+
+    def _build_lines(self):
+        """Starts one worker process per shard instead of building lines locally"""
+        self.train_lines = []
+        color_names = [color.name for color in self.colors]
+        shards = [
+            color_names[i :: self.num_shards]
+            for i in range(min(self.num_shards, len(color_names)))
+        ]
+
+        context = multiprocessing.get_context("spawn")
+        self.barrier = context.Barrier(len(shards) + 1)
+        self.stop = context.Event()
+        self.tick_millis = context.Value("q", 0)
+        for shard_id, shard_colors in enumerate(shards):
+            shard_kwargs = {
+                "sleep_seconds": self.sleep_seconds,
+                "time_step": self.time_step,
+                "unthrottled": self.unthrottled,
+                "backfill": self.backfill,
+                "network": self.network,
+                "colors": shard_colors,
+                "ridership_seed": (
+                    None
+                    if self.ridership_seed is None
+                    else self.ridership_seed + shard_id
+                ),
+            }
+            worker = context.Process(
+                target=run_shard,
+                args=(shard_kwargs, self.barrier, self.stop, self.tick_millis),
+                name=f"simulation-shard-{shard_id}",
+            )
+            worker.start()
+            logger.info(f"Started {worker.name} for lines {shard_colors}")
+            self.workers.append(worker)
+
+    def run(self):
+        try:
+            # Wait for every shard to finish building its lines
+            self.barrier.wait(SimulationSettings.SHARD_TIMEOUT_S)
+        except BrokenBarrierError:
+            logger.error("Not every shard started in time, shutting down")
+            self.close()
+            return
+        except KeyboardInterrupt:
+            logger.info("Shutting down before the simulation started")
+            self.close()
+            return
+        super().run()
+
+    def _advance_lines(self, curr_time):
+        """Releases the workers for one tick and waits until all have finished"""
+        timestamp = curr_time.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.tick_millis.value = int(round(timestamp * 1000))
+        self.barrier.wait(SimulationSettings.SHARD_TIMEOUT_S)
+        self.barrier.wait(SimulationSettings.SHARD_TIMEOUT_S)
+
+    def close(self):
+        """Stops the workers, letting each one flush its own producers while the
+        coordinator flushes the weather, and terminates those still running
+        after the shutdown deadline"""
+        deadline = (
+            time.monotonic()
+            + ProducerSettings.SHUTDOWN_TIMEOUT_S
+            + ShardedTimeSimulation.shutdown_grace_s
+        )
+        self.stop.set()
+        self.barrier.abort()
+        self.flush_producers()
+        for worker in self.workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                # Shards ignore SIGTERM, so they have to be killed
+                logger.warning(f"{worker.name} did not shut down in time, killing it")
+                worker.kill()
+                worker.join()
+        Producer.stop_recording()
+        Producer.telemetry.log_summary()
+
+
+def run_shard(shard_kwargs, barrier, stop, tick_millis):
+    """Worker process entrypoint: simulates its lines whenever a tick is released"""
+    # Shutdown is driven by the coordinator, not by the terminal's Ctrl+C or a
+    # SIGTERM sent to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    shard = None
+    try:
+        shard = SimulationShard(**shard_kwargs)
+        barrier.wait()
+        while not stop.is_set():
+            barrier.wait()
+            curr_time = datetime.datetime.utcfromtimestamp(tick_millis.value / 1000)
+            shard.tick(curr_time)
+            barrier.wait()
+    except BrokenBarrierError:
+        logger.debug("shard released by coordinator")
+    except Exception:
+        # Break the barrier right away so the coordinator does not wait for
+        # this shard until SHARD_TIMEOUT_S runs out
+        barrier.abort()
+        raise
+    finally:
+        if shard is not None:
+            shard.close()
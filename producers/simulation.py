@@ -1,18 +1,25 @@
 """Defines a time simulation responsible for executing any registered producers"""
 import datetime
-import time
 from enum import IntEnum
+import json
 import logging
 import logging.config
 from pathlib import Path
-
-import pandas as pd
+import signal
+from threading import BrokenBarrierError
+import time
 
 # Import logging before models to ensure configuration is picked up
 logging.config.fileConfig(Path(__file__).parents[0] / "logging.ini")  # noqa
 
-from connector import configure_connector
+from clock import SimulationClock
+from config import CtaTopics, ProducerSettings, RecordingSettings, SimulationSettings
+import connector
 from models import Line, Weather
+from models.network import generate_network, load_cta_network
+from models.producer import Producer
+from models.ridership import RidershipEngine
+import transport
 
 
 logger = logging.getLogger(__name__)
@@ -22,18 +29,52 @@ class TimeSimulation:
     weekdays = IntEnum("weekdays", "mon tue wed thu fri sat sun", start=0)
     ten_min_frequency = datetime.timedelta(minutes=10)
 
-    def __init__(self, sleep_seconds=5, time_step=None, schedule=None):
+    def __init__(
+        self,
+        sleep_seconds=5,
+        time_step=None,
+        schedule=None,
+        unthrottled=None,
+        backfill=None,
+        network=None,
+        colors=None,
+        ridership_seed=None,
+    ):
         """Initializes the time simulation"""
         self.sleep_seconds = sleep_seconds
+        self.network = network
+        if self.network is None:
+            self.network = TimeSimulation._load_network()
+        # Lines to simulate, as colors of the network or their names
+        self.colors = colors
+        if self.colors is None:
+            self.colors = self.network.lines
+        self.colors = [
+            self.network.colors[color] if isinstance(color, str) else color
+            for color in self.colors
+        ]
+        self.ridership_seed = ridership_seed
+        if self.ridership_seed is None:
+            self.ridership_seed = SimulationSettings.RIDERSHIP_SEED
+        self.backfill = backfill
+        if self.backfill is None:
+            self.backfill = SimulationSettings.BACKFILL
+        self.unthrottled = unthrottled
+        if self.unthrottled is None:
+            self.unthrottled = SimulationSettings.UNTHROTTLED or self.backfill
         self.time_step = time_step
         if self.time_step is None:
             self.time_step = datetime.timedelta(minutes=self.sleep_seconds)
 
-        # Read data from disk
-        logger.info("Loading cta_stations.csv")
-        self.raw_df = pd.read_csv(
-            f"{Path(__file__).parents[0]}/data/cta_stations.csv"
-        ).sort_values("order")
+        now = datetime.datetime.utcnow()
+        self.start_time = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.end_time = None
+        if self.backfill is True:
+            # Backfill from midnight `BACKFILL_DAYS` ago up to now, stamping
+            # events with the simulated time
+            self.start_time -= datetime.timedelta(days=SimulationSettings.BACKFILL_DAYS)
+            self.end_time = now
+            Producer.set_event_time(self.start_time)
 
         # Define the train schedule (same for all trains)
         self.schedule = schedule
@@ -48,37 +89,155 @@ class TimeSimulation:
                 TimeSimulation.weekdays.sun: {0: TimeSimulation.ten_min_frequency},
             }
 
+        if RecordingSettings.DIRECTORY is not None:
+            Producer.start_recording(RecordingSettings.DIRECTORY)
+
+        # Create every topic the simulation needs in one batch
+        with Producer.deferred_topic_creation():
+            self._build_lines()
+            self._build_weather()
+
+    @staticmethod
+    def _load_network():
+        """Returns the synthetic network if one is configured, the CTA otherwise"""
+        if SimulationSettings.SYNTHETIC_LINES > 0:
+            return generate_network(
+                SimulationSettings.SYNTHETIC_LINES,
+                SimulationSettings.SYNTHETIC_STATIONS_PER_LINE,
+                SimulationSettings.SYNTHETIC_TRAINS_PER_LINE,
+                seed=SimulationSettings.SYNTHETIC_SEED,
+            )
+        return load_cta_network()
+
+    def _build_lines(self):
+        """Constructs the simulated lines and their ridership engine"""
         self.train_lines = [
-            Line(Line.colors.blue, self.raw_df[self.raw_df["blue"]]),
-            Line(Line.colors.red, self.raw_df[self.raw_df["red"]]),
-            Line(Line.colors.green, self.raw_df[self.raw_df["green"]]),
+            Line(
+                color,
+                self.network.line_stations(color),
+                num_trains=self.network.trains_per_line,
+            )
+            for color in self.colors
         ]
+        self.ridership = RidershipEngine(
+            [
+                station.station_id
+                for line in self.train_lines
+                for station in line.stations
+            ],
+            seed=self.ridership_seed,
+            ridership=self.network.ridership,
+            hour_ratios=self.network.hour_ratios,
+        )
+        if not transport.uses_kafka():
+            self._publish_stations()
+        elif Producer.recorder is not None:
+            self._record_stations()
+
+    def _station_values(self):
+        """Yields the stations of the simulated lines as Faust publishes them"""
+        for line in self.train_lines:
+            for order, station in enumerate(line.stations):
+                yield json.dumps(
+                    {
+                        "station_id": station.station_id,
+                        "station_name": station.name,
+                        "order": order,
+                        "line": line.color.name,
+                    }
+                )
+
+    def _record_stations(self):
+        """Records the stations as Faust publishes them, so that a replay into
+        the consumer knows the stations the recorded arrivals refer to"""
+        event_ms = Producer.event_time_ms
+        if event_ms is None:
+            event_ms = int(round(time.time() * 1000))
+        for value in self._station_values():
+            Producer.recorder.record(CtaTopics.STATIONS_LINE, event_ms, None, value)
+
+    def _publish_stations(self):
+        """Publishes the stations in place of Faust, which only runs against
+        Kafka. They are recorded too, if a recording is in progress."""
+        stations_line = Producer(topic_name=CtaTopics.STATIONS_LINE)
+        for value in self._station_values():
+            stations_line.produce(key=None, value=value)
+
+    def _build_weather(self):
+        """Constructs the weather model and the connector's stations topic"""
+        logger.info("Initializing weather model data")
+        self.weather = Weather(self.start_time.month)
+        connector.create_topic()
 
     def run(self):
-        curr_time = datetime.datetime.utcnow().replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
+        curr_time = self.start_time
+        # Container runtimes stop the simulation with SIGTERM, which shuts it down
+        # the same way as Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
         logger.info("Beginning simulation, press Ctrl+C to exit at any time")
         logger.info("loading kafka connect jdbc source connector")
-        configure_connector()
+        connector.configure_connector()
 
-        logger.info("Initializing weather model data")
-        weather = Weather(curr_time.month)
-        
         logger.info("beginning cta train simulation")
+        clock = SimulationClock(self.sleep_seconds, unthrottled=self.unthrottled)
+        clock.start()
         try:
-            while True:
+            while self.end_time is None or curr_time < self.end_time:
                 logger.debug("simulation running: %s", curr_time.isoformat())
-                # Send weather on the top of the hour
-                if curr_time.minute == 0:
-                    weather.run(curr_time.month)
-                _ = [line.run(curr_time, self.time_step) for line in self.train_lines]
+                self.tick(curr_time)
                 curr_time = curr_time + self.time_step
-                time.sleep(self.sleep_seconds)
+                clock.wait()
+            logger.info("Backfill complete after %s", clock.summary())
         except KeyboardInterrupt:
-            logger.info("Shutting down")
-            _ = [line.close() for line in self.train_lines]
+            logger.info("Shutting down after %s", clock.summary())
+        except BrokenBarrierError:
+            # Raised by sharded simulations when a shard dies or times out
+            logger.error(
+                "A shard stopped responding, shutting down after %s", clock.summary()
+            )
+        finally:
+            self.close()
+
+    def tick(self, curr_time):
+        """Runs a single simulation step at the given simulated time"""
+        if self.backfill is True:
+            Producer.set_event_time(curr_time)
+        # Send weather on the top of the hour
+        if self.weather is not None and curr_time.minute == 0:
+            self.weather.run(curr_time.month)
+        self._advance_lines(curr_time)
+        if self.unthrottled is True:
+            Producer.drain(ProducerSettings.UNTHROTTLED_MAX_QUEUED)
+        Producer.telemetry.maybe_log_summary()
+
+    def close(self):
+        """Flushes all producers of the simulation"""
+        self.flush_producers()
+        Producer.stop_recording()
+        Producer.telemetry.log_summary()
+
+    def flush_producers(self):
+        """Flushes the pooled clients and the weather REST Proxy client at once,
+        within `ProducerSettings.SHUTDOWN_TIMEOUT_S`"""
+        flushes = []
+        if self.weather is not None and self.weather.rest_proxy is not None:
+            flushes.append(self.weather.rest_proxy.close)
+        Producer.shutdown(flushes=flushes)
+
+    def _advance_lines(self, curr_time):
+        """Draws turnstile entries for all stations at once and advances each line"""
+        entries = self.ridership.get_entries(curr_time, self.time_step).tolist()
+        offset = 0
+        for line in self.train_lines:
+            num_stations = len(line.stations)
+            line.run(curr_time, self.time_step, entries[offset : offset + num_stations])
+            offset += num_stations
 
 
 if __name__ == "__main__":
-    TimeSimulation().run()
+    if SimulationSettings.NUM_SHARDS > 1:
+        from sharding import ShardedTimeSimulation
+
+        ShardedTimeSimulation().run()
+    else:
+        TimeSimulation().run()
@@ -1,7 +1,42 @@
+from concurrent.futures import Future
+import datetime
+import json
+import pickle
+from threading import BrokenBarrierError
+import time
+from types import SimpleNamespace
+
 import pytest
+import requests
 
-from config import join_topic_name
-from models import utils
+import clock
+from config import (
+    CtaTopics,
+    join_topic_name,
+    ProducerSettings,
+    TopicSettings,
+    TransportSettings,
+)
+from models import (
+    Line,
+    Station,
+    Train,
+    Turnstile,
+    Weather,
+    producer,
+    topology,
+    turnstile_hardware,
+    utils,
+)
+from models.network import generate_network
+from models.rest_proxy import RestProxyClient
+from models.ridership import RidershipEngine
+from models.telemetry import ProducerTelemetry
+from models.turnstile_hardware import TurnstileHardware
+import recording
+import sharding
+import simulation
+import transport
 
 
 def test_utils_load_schema():
@@ -34,3 +69,633 @@ def test_config_join_topic_name(topic_segments, output_topic):
         assert join_topic_name(topic_segments) == output_topic
     else:
         assert join_topic_name(*topic_segments) == output_topic
+
+
+class FakeAvroProducer:
+    """Records produced messages in place of a Kafka client"""
+
+    def __init__(self, config, **kwargs):
+        self.config = config
+        self.records = []
+
+    def poll(self, timeout=None):
+        return 0
+
+    def produce(self, **kwargs):
+        self.records.append(kwargs)
+
+    def flush(self, timeout=None):
+        return 0
+
+    def __len__(self):
+        return 0
+
+
+@pytest.fixture
+def fake_kafka(monkeypatch):
+    monkeypatch.setattr(producer, "AvroProducer", FakeAvroProducer)
+    monkeypatch.setattr(producer.Producer, "pool", [])
+    monkeypatch.setattr(producer.Producer, "existing_topics", set())
+    monkeypatch.setattr(producer.Producer, "create_topic", lambda self: None)
+    return producer.Producer
+
+
+def test_producer_pool_is_shared(fake_kafka, monkeypatch):
+    monkeypatch.setattr(ProducerSettings, "POOL_SIZE", 2)
+    producers = [fake_kafka(topic_name=f"topic.{i}") for i in range(5)]
+    clients = {id(p.producer) for p in producers}
+    assert len(clients) == 2
+    assert producers[0].producer is producers[2].producer
+    assert producers[0].producer.config["linger.ms"] == ProducerSettings.LINGER_MS
+
+
+def test_producer_produce_passes_schemas(fake_kafka):
+    schema = utils.load_schema("arrival_key.json")
+    p = fake_kafka(topic_name="topic", key_schema=schema, value_schema=schema)
+    p.produce(key={"timestamp": 1}, value={"timestamp": 2})
+    (record,) = p.producer.records
+    assert record["topic"] == "topic"
+    assert record["key_schema"] is schema
+
+
+@pytest.mark.parametrize("aggregate,num_records", [(False, 7), (True, 1)])
+def test_turnstile_emission_modes(fake_kafka, monkeypatch, aggregate, num_records):
+    station = SimpleNamespace(
+        station_id=40380, name="Clark/Lake", color=Line.colors.blue
+    )
+    turnstile = Turnstile(station, aggregate=aggregate)
+    monkeypatch.setattr(turnstile.turnstile_hardware, "get_entries", lambda *args: 7)
+    turnstile.run(datetime.datetime(2019, 1, 1), datetime.timedelta(minutes=5))
+    records = turnstile.producer.records
+    assert len(records) == num_records
+    assert sum(r["value"]["num_entries"] for r in records) == 7
+
+
+def test_ridership_engine_matches_turnstile_hardware(monkeypatch):
+    station_ids = [40380, 40260, 41660]
+    monkeypatch.setattr(RidershipEngine, "noise_low", 0)
+    monkeypatch.setattr(RidershipEngine, "noise_high", 1)
+    monkeypatch.setattr(turnstile_hardware.random, "choice", lambda _: 0)
+    engine = RidershipEngine(station_ids)
+    time_step = datetime.timedelta(minutes=5)
+    for day in (7, 12, 13):  # monday, saturday, sunday
+        timestamp = datetime.datetime(2019, 1, day, 8)
+        expected = [
+            TurnstileHardware(SimpleNamespace(station_id=sid)).get_entries(
+                timestamp, time_step
+            )
+            for sid in station_ids
+        ]
+        assert engine.get_entries(timestamp, time_step).tolist() == expected
+
+
+def test_ridership_engine_is_seedable():
+    timestamp = datetime.datetime(2019, 1, 7, 8)
+    time_step = datetime.timedelta(minutes=5)
+    first = RidershipEngine([40380, 40260], seed=42).get_entries(timestamp, time_step)
+    second = RidershipEngine([40380, 40260], seed=42).get_entries(timestamp, time_step)
+    assert first.tolist() == second.tolist()
+
+
+def turnstile_hardware_seed_ids(num_stations):
+    return list(topology.load_topology()["ridership"])[:num_stations]
+
+
+def test_line_advance_trains_moves_every_train_once(fake_kafka):
+    station_data = [
+        (station_id, f"Station {i}")
+        for i, station_id in enumerate(turnstile_hardware_seed_ids(8))
+    ]
+    line = Line(Line.colors.blue, station_data, num_trains=4)
+    records = line.stations[0].producer.records
+    last_seen = {}
+    for _ in range(line.num_stations * Line.num_directions):
+        records.clear()
+        line._advance_trains()
+        assert len(records) == line.num_trains
+        for record in records:
+            value = record["value"]
+            if value["train_id"] in last_seen:
+                assert last_seen[value["train_id"]] == (
+                    value["prev_station_id"],
+                    value["prev_direction"],
+                )
+            last_seen[value["train_id"]] = (value["station_id"], value["direction"])
+    # After a full loop every train is back where it started
+    assert [s.b_train.train_id for s in line.stations if s.b_train] == [
+        "BL000",
+        "BL001",
+        "BL002",
+    ]
+
+
+class FakeAdminClient:
+    """Counts metadata and topic creation requests"""
+
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.requests = []
+
+    def list_topics(self, timeout=None):
+        self.requests.append("list_topics")
+        return SimpleNamespace(topics={topic: None for topic in self.topics})
+
+    def create_topics(self, new_topics):
+        self.requests.append("create_topics")
+        futures = {}
+        for new_topic in new_topics:
+            self.topics.add(new_topic.topic)
+            futures[new_topic.topic] = Future()
+            futures[new_topic.topic].set_result(None)
+        return futures
+
+
+def test_producer_deferred_topic_creation_batches_requests(fake_kafka, monkeypatch):
+    admin = FakeAdminClient(["topic.0"])
+    monkeypatch.setattr(producer.Producer, "admin_client", admin)
+
+    with producer.Producer.deferred_topic_creation():
+        producers = [fake_kafka(topic_name=f"topic.{i}") for i in range(4)]
+        producers[1].produce(key={"timestamp": 1}, value={})
+        assert producers[1].producer.records == []
+
+    assert admin.requests == ["list_topics", "create_topics"]
+    assert admin.topics == {f"topic.{i}" for i in range(4)}
+    assert len(producers[1].producer.records) == 1
+
+
+class FailingAdminClient(FakeAdminClient):
+    """Fails every topic creation with an error other than a KafkaException"""
+
+    def create_topics(self, new_topics):
+        futures = {}
+        for new_topic in new_topics:
+            futures[new_topic.topic] = Future()
+            futures[new_topic.topic].set_exception(ValueError("bad topic"))
+        return futures
+
+
+def test_producer_create_topics_logs_unexpected_failures(fake_kafka, monkeypatch):
+    monkeypatch.setattr(producer.Producer, "admin_client", FailingAdminClient([]))
+    producer.Producer.create_topics([fake_kafka(topic_name="topic").new_topic()])
+    assert "topic" in producer.Producer.existing_topics
+
+
+def test_simulation_clock_compensates_for_work_time(monkeypatch):
+    now = [100.0]
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(round(seconds, 3))
+        now[0] += seconds
+
+    monkeypatch.setattr(clock.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(clock.time, "sleep", fake_sleep)
+
+    sim_clock = clock.SimulationClock(5)
+    sim_clock.start()
+    for work_seconds in (1.0, 4.5, 7.0, 2.0):
+        now[0] += work_seconds
+        sim_clock.wait()
+
+    assert sleeps == [4.0, 0.5, 3.0]
+    assert sim_clock.overruns == 1
+
+
+def test_simulation_clock_unthrottled_never_sleeps(monkeypatch):
+    monkeypatch.setattr(clock.time, "sleep", pytest.fail)
+    sim_clock = clock.SimulationClock(5, unthrottled=True)
+    sim_clock.start()
+    for _ in range(3):
+        sim_clock.wait()
+    assert sim_clock.ticks == 3
+
+
+def test_producer_stamps_simulated_event_time(fake_kafka, monkeypatch):
+    monkeypatch.setattr(producer.Producer, "event_time_ms", None)
+    p = fake_kafka(topic_name="topic")
+    producer.Producer.set_event_time(datetime.datetime(2019, 1, 1, 8, 30))
+    p.produce(key={"timestamp": p.time_millis()}, value={})
+    (record,) = p.producer.records
+    assert record["key"]["timestamp"] == 1546331400000
+    assert record["timestamp"] == 1546331400000
+
+
+def test_topology_cache_is_rebuilt_when_station_data_changes(tmp_path, monkeypatch):
+    for name in topology.SOURCE_FILES:
+        (tmp_path / name).write_bytes((topology.DATA_DIR / name).read_bytes())
+    monkeypatch.setattr(topology, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(topology, "CACHE_FILE", tmp_path / "topology.cache.json")
+
+    first = topology.load_topology()
+    assert topology.CACHE_FILE.exists()
+    assert topology.load_topology() == first
+
+    with open(tmp_path / "ridership_seed.csv", "a") as seed_file:
+        seed_file.write("\n99999,Test Station,10/01/2018,1.0,2.0,3.0,6")
+    assert topology.load_topology()["ridership"][99999] == (1.0, 2.0, 3.0)
+
+
+def test_generate_network_shape():
+    network = generate_network(3, 20, 4, seed=7)
+    assert [color.name for color in network.lines] == [
+        "line_000",
+        "line_001",
+        "line_002",
+    ]
+    assert len(network.line_stations(network.lines[1])) == 20
+    station_ids = [
+        station_id
+        for color in network.lines
+        for station_id, _ in network.line_stations(color)
+    ]
+    assert len(set(station_ids)) == len(station_ids) == 60
+    assert set(network.ridership) == set(station_ids)
+    real_rides = set(topology.load_topology()["ridership"].values())
+    assert set(network.ridership.values()) <= real_rides
+
+
+def test_generated_network_is_rebuilt_identically_when_pickled():
+    network = generate_network(2, 10, 2, seed=3)
+    clone = pickle.loads(pickle.dumps(network))
+    assert clone.stations == network.stations
+    assert clone.ridership == network.ridership
+    assert [color.name for color in clone.lines] == ["line_000", "line_001"]
+
+
+def test_train_ids_are_unique_across_lines(fake_kafka):
+    network = generate_network(2, 10, 2, seed=3)
+    lines = [
+        Line(color, network.line_stations(color), num_trains=2)
+        for color in network.lines
+    ]
+    lines.append(Line(Line.colors.blue, [(1, "a"), (2, "b"), (3, "c")], num_trains=1))
+    train_ids = [train.train_id for line in lines for train in line.trains]
+    assert train_ids == [
+        "LINE_000L000",
+        "LINE_000L001",
+        "LINE_001L000",
+        "LINE_001L001",
+        "BL000",
+    ]
+
+
+class FakeSession:
+    """Captures REST Proxy requests"""
+
+    def __init__(self, error=None):
+        self.payloads = []
+        self.timeouts = []
+        self.error = error
+
+    def post(self, url, data, timeout=None):
+        self.payloads.append(json.loads(data))
+        self.timeouts.append(timeout)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(
+            raise_for_status=lambda: None,
+            json=lambda: {"key_schema_id": 1, "value_schema_id": 2},
+        )
+
+
+def test_rest_proxy_client_batches_and_caches_schema_ids(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(RestProxyClient, "session", session)
+    client = RestProxyClient(
+        "weather", Weather.key_schema, Weather.value_schema, batch_size=2
+    )
+    for i in range(5):
+        client.produce(key={"timestamp": i}, value={"temperature": 1.0})
+    client.close()
+
+    assert [len(p["records"]) for p in session.payloads] == [2, 2, 1]
+    assert "key_schema" in session.payloads[0]
+    assert session.payloads[1]["key_schema_id"] == 1
+    assert session.payloads[2]["value_schema_id"] == 2
+    assert "value_schema" not in session.payloads[2]
+    assert session.timeouts == [ProducerSettings.REST_PROXY_TIMEOUT_S] * 3
+
+
+def test_rest_proxy_client_counts_unreachable_proxy_as_failed(monkeypatch):
+    session = FakeSession(error=requests.exceptions.ConnectionError("refused"))
+    monkeypatch.setattr(RestProxyClient, "session", session)
+    telemetry = ProducerTelemetry()
+    client = RestProxyClient(
+        "weather",
+        Weather.key_schema,
+        Weather.value_schema,
+        batch_size=2,
+        telemetry=telemetry,
+    )
+    for i in range(3):
+        client.produce(key={"timestamp": i}, value={"temperature": 1.0})
+    client.close()
+
+    stats = telemetry.topic("weather")
+    assert (stats.produced, stats.delivered, stats.failed) == (3, 0, 3)
+    assert client.key_schema_id is None
+    assert "key_schema" in session.payloads[-1]
+
+
+@pytest.fixture(params=["memory", "file"])
+def transport_backend(request, monkeypatch, tmp_path):
+    monkeypatch.setattr(TransportSettings, "BACKEND", request.param)
+    monkeypatch.setattr(TransportSettings, "FILE_DIR", str(tmp_path))
+    monkeypatch.setattr(transport, "brokers", {})
+    monkeypatch.setattr(producer.Producer, "pool", [])
+    monkeypatch.setattr(producer.Producer, "admin_client", None)
+    monkeypatch.setattr(producer.Producer, "existing_topics", set())
+    return transport.broker()
+
+
+def test_transport_delivers_to_pattern_subscribers(transport_backend):
+    consumer = transport.TransportConsumer(
+        transport_backend, {"group.id": "test", "auto.offset.reset": "earliest"}
+    )
+    consumer.subscribe(["^arrivals.*"])
+    producers = [
+        producer.Producer(topic_name=f"arrivals.{name}", num_partitions=3)
+        for name in ("clark", "belmont")
+    ]
+    producer.Producer(topic_name="turnstiles").produce(key=None, value={"n": 1})
+    for i in range(10):
+        producers[i % 2].produce(key={"timestamp": i}, value={"seq": i})
+
+    messages = consumer.consume(20, timeout=1.0)
+    assert sorted(m.value()["seq"] for m in messages) == list(range(10))
+    assert {m.topic() for m in messages} == {"arrivals.clark", "arrivals.belmont"}
+    assert consumer.poll(0) is None
+
+
+def test_file_transport_notices_topics_created_in_quick_succession(tmp_path):
+    broker = transport.FileBroker(tmp_path)
+    consumer = transport.TransportConsumer(
+        broker, {"group.id": "test", "auto.offset.reset": "earliest"}
+    )
+    consumer.subscribe(["^arrivals.*"])
+    versions = {broker.metadata_version()}
+    for name in ("clark", "belmont"):
+        broker.create_topic(f"arrivals.{name}")
+        versions.add(broker.metadata_version())
+        broker.append(f"arrivals.{name}", None, {"station": name}, 0)
+        assert consumer.consume(1, timeout=1.0)[0].value() == {"station": name}
+    assert len(versions) == 3
+
+
+def test_transport_consumer_resumes_from_committed_offsets(transport_backend):
+    topic = producer.Producer(topic_name="weather")
+    config = {"group.id": "test", "auto.offset.reset": "earliest"}
+    first = transport.TransportConsumer(transport_backend, config)
+    first.subscribe(["weather"])
+    for i in range(3):
+        topic.produce(key={"timestamp": i}, value={"seq": i})
+    assert [first.poll(1.0).value()["seq"] for _ in range(2)] == [0, 1]
+    first.close()
+
+    second = transport.TransportConsumer(transport_backend, config)
+    second.subscribe(["weather"])
+    assert second.poll(1.0).value()["seq"] == 2
+
+
+def test_recorded_segments_replay_in_event_time_order(fake_kafka, tmp_path):
+    fake_kafka.start_recording(tmp_path)
+    fake_kafka.recorder.segment_records = 3
+    fake_kafka.recorder.block_records = 2
+    weather = fake_kafka(
+        topic_name="weather",
+        key_schema=Weather.key_schema,
+        value_schema=Weather.value_schema,
+    )
+    for event_ms in range(5):
+        fake_kafka.event_time_ms = event_ms
+        weather.produce(key={"timestamp": event_ms}, value={"temperature": 1.0})
+    fake_kafka.stop_recording()
+    fake_kafka.event_time_ms = None
+    # A second process recording alongside
+    other = recording.SegmentRecorder(tmp_path)
+    other.record("stations", 2, None, "{}")
+    other.close()
+
+    assert len(recording.segment_paths([tmp_path])) == 3
+    records = list(recording.paced(recording.read_segments([tmp_path]), None))
+    assert [r.event_ms for r in records] == [0, 1, 2, 2, 3, 4]
+    assert records[0].key == {"timestamp": 0}
+    assert json.loads(records[0].value_schema) == Weather.value_schema.to_json()
+    assert [r.value_schema for r in records if r.topic == "stations"] == [None]
+
+
+def test_producer_telemetry_counts_deliveries_and_latency():
+    telemetry = ProducerTelemetry()
+    delivered = SimpleNamespace(topic=lambda: "arrivals", latency=lambda: 0.004)
+    for _ in range(3):
+        telemetry.produced("arrivals")
+        telemetry.on_delivery(None, delivered)
+    telemetry.on_delivery("timed out", delivered)
+    telemetry.on_stats(
+        json.dumps(
+            {
+                "name": "rdkafka#producer-1",
+                "msg_cnt": 12,
+                "brokers": {"b1": {"name": "b1", "rtt": {"cnt": 4, "avg": 2500}}},
+            }
+        )
+    )
+
+    snapshot = telemetry.snapshot()
+    arrivals = snapshot["topics"]["arrivals"]
+    assert (arrivals["produced"], arrivals["delivered"], arrivals["failed"]) == (3, 3, 1)
+    assert arrivals["latency_ms"]["p50"] == 5
+    assert snapshot["queue_lengths"] == {"rdkafka#producer-1": 12}
+    assert snapshot["broker_rtt_ms"] == {"b1": 2.5}
+
+
+class FullQueueProducer(FakeAvroProducer):
+    """Rejects the first `full_for` produce calls as if its queue was full"""
+
+    full_for = 2
+
+    def poll(self, timeout=None):
+        time.sleep(timeout or 0)
+        return 0
+
+    def produce(self, **kwargs):
+        if FullQueueProducer.full_for > 0:
+            FullQueueProducer.full_for -= 1
+            raise BufferError("Local: Queue full")
+        super().produce(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "strategy,full_for,num_records,num_shed",
+    [("block", 2, 1, 0), ("shed", 1, 0, 1), ("block", 1000, 0, 1)],
+)
+def test_produce_applies_backpressure_when_queue_is_full(
+    fake_kafka, monkeypatch, strategy, full_for, num_records, num_shed
+):
+    monkeypatch.setattr(producer, "AvroProducer", FullQueueProducer)
+    monkeypatch.setattr(FullQueueProducer, "full_for", full_for)
+    monkeypatch.setattr(ProducerSettings, "BACKPRESSURE", strategy)
+    monkeypatch.setattr(ProducerSettings, "BACKPRESSURE_MAX_BLOCK_S", 0.05)
+    monkeypatch.setattr(ProducerSettings, "BACKPRESSURE_POLL_S", 0.001)
+    monkeypatch.setattr(fake_kafka, "telemetry", ProducerTelemetry())
+    p = fake_kafka(topic_name="arrivals")
+    p.produce(key={"timestamp": 0}, value={})
+
+    stats = fake_kafka.telemetry.topic("arrivals")
+    assert len(p.producer.records) == num_records
+    assert (stats.produced, stats.shed) == (num_records, num_shed)
+    assert stats.blocked == (1 if strategy == "block" else 0)
+
+
+def test_consolidated_arrivals_share_one_station_keyed_topic(fake_kafka, monkeypatch):
+    monkeypatch.setattr(TopicSettings, "CONSOLIDATED_ARRIVALS", True)
+    stations = [
+        Station(40380, "Clark/Lake", Line.colors.blue),
+        Station(40260, "State/Lake", Line.colors.green),
+    ]
+    train = Train("BL000", Train.status.in_service)
+    for station in stations:
+        station.run(train, "a", None, None)
+
+    records = stations[0].producer.records
+    assert {r["topic"] for r in records} == {CtaTopics.ARRIVALS}
+    assert [r["key"] for r in records] == [{"station_id": 40380}, {"station_id": 40260}]
+    assert records[0]["key_schema"] is Station.station_key_schema
+    assert stations[0].num_partitions == TopicSettings.ARRIVALS_PARTITIONS
+
+
+def test_station_keyed_records_key_turnstiles_and_arrivals_by_station(
+    fake_kafka, monkeypatch
+):
+    monkeypatch.setattr(TopicSettings, "STATION_KEYED_RECORDS", True)
+    station = Station(40380, "Clark/Lake", Line.colors.blue)
+    station.turnstile.run(
+        datetime.datetime(2019, 1, 1), datetime.timedelta(minutes=5), num_entries=2
+    )
+    station.run(Train("BL000", Train.status.in_service), "a", None, None)
+
+    records = station.producer.records
+    assert [r["key"] for r in records] == [{"station_id": 40380}] * 3
+    assert records[0]["topic"] == CtaTopics.TURNSTILES
+    assert records[0]["key_schema"] is Turnstile.station_key_schema
+    assert records[2]["key_schema"] is Station.station_key_schema
+
+
+class StuckProducer(FakeAvroProducer):
+    """Never finishes flushing, as if the broker was unreachable"""
+
+    def flush(self, timeout=None):
+        time.sleep(60)
+
+
+def test_shutdown_reports_undelivered_records_after_deadline(fake_kafka, monkeypatch):
+    monkeypatch.setattr(producer, "AvroProducer", StuckProducer)
+    monkeypatch.setattr(ProducerSettings, "POOL_SIZE", 2)
+    monkeypatch.setattr(fake_kafka, "telemetry", ProducerTelemetry())
+    for i in range(3):
+        fake_kafka(topic_name=f"topic.{i % 2}").produce(key=None, value={})
+    flushed = []
+
+    start = time.monotonic()
+    undelivered = fake_kafka.shutdown(timeout=0.1, flushes=[lambda: flushed.append(1)])
+    assert time.monotonic() - start < 1.0
+    assert flushed == [1]
+    assert undelivered == {"topic.0": 2, "topic.1": 1}
+
+
+class BrokenBarrier:
+    def wait(self, timeout=None):
+        raise BrokenBarrierError
+
+
+def test_broken_shard_barrier_still_closes_the_simulation(monkeypatch):
+    monkeypatch.setattr(simulation.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(simulation.connector, "configure_connector", lambda: None)
+    closed = []
+    monkeypatch.setattr(
+        sharding.ShardedTimeSimulation, "close", lambda self: closed.append(self)
+    )
+    sim = sharding.ShardedTimeSimulation.__new__(sharding.ShardedTimeSimulation)
+    sim.barrier = BrokenBarrier()
+    sim.run()
+
+    sim.barrier = SimpleNamespace(wait=lambda timeout=None: None)
+    sim.start_time = datetime.datetime(2019, 1, 1)
+    sim.end_time = None
+    sim.sleep_seconds = 0
+    sim.unthrottled = True
+    sim.tick = BrokenBarrier().wait
+    sim.run()
+    assert closed == [sim, sim]
+
+
+class RecordingBarrier:
+    def __init__(self):
+        self.calls = []
+
+    def wait(self, timeout=None):
+        self.calls.append("wait")
+
+    def abort(self):
+        self.calls.append("abort")
+
+
+class FailingShard:
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.closed = False
+        FailingShard.instances.append(self)
+
+    def tick(self, curr_time):
+        raise RuntimeError("tick failed")
+
+    def close(self):
+        self.closed = True
+
+
+def failing_constructor(**kwargs):
+    raise RuntimeError("build failed")
+
+
+@pytest.mark.parametrize("shard_class", [failing_constructor, FailingShard])
+def test_failing_shard_aborts_the_barrier(monkeypatch, shard_class):
+    monkeypatch.setattr(sharding.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(sharding, "SimulationShard", shard_class)
+    monkeypatch.setattr(FailingShard, "instances", [])
+    barrier = RecordingBarrier()
+    stop = SimpleNamespace(is_set=lambda: False)
+    with pytest.raises(RuntimeError):
+        sharding.run_shard({}, barrier, stop, SimpleNamespace(value=0))
+
+    assert barrier.calls[-1] == "abort"
+    assert all(shard.closed for shard in FailingShard.instances)
+
+
+@pytest.mark.parametrize("aggregate", [True, False])
+def test_turnstiles_publish_station_summaries_without_kafka(
+    transport_backend, monkeypatch, aggregate
+):
+    monkeypatch.setattr(Turnstile, "station_entries", {})
+    # Clark/Lake is served by the blue and the green line
+    turnstiles = [
+        Turnstile(
+            SimpleNamespace(station_id=40380, name="Clark/Lake", color=color),
+            aggregate=aggregate,
+        )
+        for color in (Line.colors.blue, Line.colors.green)
+    ]
+    for turnstile, num_entries in zip(turnstiles, (3, 4)):
+        turnstile.run(datetime.datetime(2019, 1, 1), None, num_entries=num_entries)
+    turnstiles[0].run(datetime.datetime(2019, 1, 1), None, num_entries=0)
+
+    consumer = transport.TransportConsumer(
+        transport_backend, {"group.id": "test", "auto.offset.reset": "earliest"}
+    )
+    consumer.subscribe([CtaTopics.TURNSTILES_SUMMARY])
+    messages = consumer.consume(10, timeout=1.0)
+    assert [json.loads(m.value()) for m in messages] == [
+        {"STATION_ID": 40380, "COUNT": 3},
+        {"STATION_ID": 40380, "COUNT": 7},
+    ]
@@ -0,0 +1 @@
+../consumers/transport.py
\ No newline at end of file